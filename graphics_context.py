@@ -22,13 +22,21 @@ A thin wrapper to produce vector graphics using cairo.
 """
 
 import logging
+import sys
 
-from math import pi, sin, cos
+from math import sin, cos, hypot
 
 from typing import Dict, List, Optional, Sequence
 
 import cairocffi as cairo
-from graphics_context_constants import unit_deg, unit_mm, font_size_base, line_width_base, dots_per_inch
+from graphics_context_constants import unit_deg, unit_rev, unit_mm, unit_inch, font_size_base, line_width_base, \
+    dots_per_inch
+
+# Types of path element accepted by GraphicsContext.append_path
+path_move_to: int = cairo.PATH_MOVE_TO
+path_line_to: int = cairo.PATH_LINE_TO
+path_curve_to: int = cairo.PATH_CURVE_TO
+path_close_path: int = cairo.PATH_CLOSE_PATH
 
 
 class GraphicsPage:
@@ -65,7 +73,7 @@ class GraphicsPage:
 
         self.format: str = img_format
         self.output: str = "{}.{}".format(output, img_format)
-        self.dots_per_metre: float = dots_per_inch * 39.370079
+        self.dots_per_metre: float = dots_per_inch / unit_inch
         self.width: int = int(width * self.dots_per_metre)  # pixels
         self.height: int = int(height * self.dots_per_metre)  # pixels
 
@@ -227,6 +235,19 @@ class GraphicsContext:
         """
         self.context.curve_to(x1=x0, y1=y0, x2=x1, y2=y1, x3=x2, y3=y2)
 
+    def append_path(self, path: Sequence[tuple]) -> None:
+        """
+        Append a whole sequence of path elements to the current path, in a single call to Cairo.
+
+        :param path:
+            Sequence of (element type, coordinates) tuples, where the element type is one of path_move_to,
+            path_line_to, path_curve_to or path_close_path, and coordinates is a tuple of the positions of the
+            element's points, (x, y) or (x0, y0, x1, y1, x2, y2), metres.
+        :return:
+            None
+        """
+        self.context.append_path(path)
+
     def close_path(self) -> None:
         """
         Close the current path.
@@ -288,7 +309,7 @@ class GraphicsContext:
         :param radius:
             The radius of the circles, metres
         """
-        self.arc(centre_x=centre_x, centre_y=centre_y, radius=radius, arc_from=0, arc_to=2 * pi)
+        self.arc(centre_x=centre_x, centre_y=centre_y, radius=radius, arc_from=0, arc_to=unit_rev)
 
     def rectangle(self, x0: float, y0: float, x1: float, y1: float) -> None:
         """
@@ -614,6 +635,76 @@ class GraphicsContext:
         # Return success flag
         return outcome
 
+    def paint_pil_image(self, image, x_left: float, y_top: float,
+                        target_width: float, target_height: float) -> bool:
+        """
+        Render an image held in memory by the Python Imaging Library onto the Cairo canvas. Images which are enlarged
+        are scaled with nearest-neighbour sampling, so that low-resolution images such as sprites keep their hard
+        edges; images which are reduced in size use Cairo's default filter.
+
+        :param image:
+            The PIL Image object to render
+        :param x_left:
+            The X coordinate of the left side of the image on the canvas, metres
+        :param y_top:
+            The Y coordinate of the top side of the image on the canvas, metres
+        :param target_width:
+            The intended width of the image, metres
+        :param target_height:
+            The intended height of the image, metres
+        :return:
+            Boolean flag indicating whether the image was successfully rendered
+        """
+
+        # Save the state of the display context
+        self.context.save()
+        try:
+            # Cairo's ARGB32 format stores premultiplied alpha, in native byte order, so the bytes of each pixel
+            # are in the order B, G, R, A on little-endian machines, and A, R, G, B on big-endian machines
+            img_width, img_height = image.size
+            premultiplied = image.convert("RGBa")
+            if sys.byteorder == "little":
+                pixel_data = bytearray(premultiplied.tobytes("raw", "BGRa"))
+            else:
+                # PIL has no packer for this byte order, so move the alpha channel to the front ourselves
+                rgba = premultiplied.tobytes("raw", "RGBa")
+                pixel_data = bytearray(len(rgba))
+                pixel_data[0::4] = rgba[3::4]
+                pixel_data[1::4] = rgba[0::4]
+                pixel_data[2::4] = rgba[1::4]
+                pixel_data[3::4] = rgba[2::4]
+            image_surface = cairo.ImageSurface.create_for_data(pixel_data, cairo.FORMAT_ARGB32,
+                                                               img_width, img_height, img_width * 4)
+
+            # Calculate proportional scaling to get the image to the desired size
+            width_ratio = float(target_width) / float(img_width)
+            height_ratio = float(target_height) / float(img_height)
+
+            # Scale image and add it to the canvas
+            self.context.translate(x_left, y_top)
+            self.context.scale(width_ratio, height_ratio)
+            pattern = cairo.SurfacePattern(image_surface)
+
+            # Only use nearest-neighbour sampling if each image pixel covers at least one device pixel in both
+            # directions; when the image is being reduced in size, it would drop whole rows and columns of pixels
+            device_x_scale = hypot(*self.context.user_to_device_distance(1., 0.))
+            device_y_scale = hypot(*self.context.user_to_device_distance(0., 1.))
+            if device_x_scale >= 1 and device_y_scale >= 1:
+                pattern.set_filter(cairo.FILTER_NEAREST)
+            self.context.set_source(pattern)
+
+            self.context.paint()
+            outcome = True
+        except Exception as e:
+            logging.info("Failed to render PIL image: {}".format(e))
+            outcome = False
+
+        # Make sure that we undo the coordinate transformation, even if the image render fails
+        self.context.restore()
+
+        # Return success flag
+        return outcome
+
     def matrix_transformation_set(self, xx: float, yx: float, xy: float, yy: float, x0: float, y0: float,
                                   centre_x: float, centre_y: float):
         """
@@ -21,19 +21,52 @@
 The file contains global settings for graphics_context output.
 """
 
-from math import pi
+import logging
+import math
+import os
+
+from typing import Final, Optional
+
+
+def _read_dpi_override() -> Optional[float]:
+    """
+    Read the output resolution requested by the environment variable DRAWFILE_DPI, if it is set.
+
+    :return:
+        The requested resolution in dots per inch, or None if DRAWFILE_DPI is not set or is not a positive number
+    """
+    value = os.environ.get("DRAWFILE_DPI")
+    if value is None:
+        return None
+
+    try:
+        dpi = float(value)
+    except ValueError:
+        dpi = math.nan
+
+    if not (math.isfinite(dpi) and dpi > 0):
+        logging.warning("Ignoring invalid DRAWFILE_DPI value <{}>; using the default resolution".format(value))
+        return None
+
+    return dpi
+
 
 # Units
-dots_per_inch = 200
+# The output resolution may be overridden by setting the environment variable DRAWFILE_DPI. This sets the default
+# resolution of bitmap GraphicsPages, and of DrawFileRender.render_to_context (which otherwise renders at 72 dpi).
+# PDF and SVG pages are always measured in points, so are unaffected.
+dots_per_inch_override: Final[Optional[float]] = _read_dpi_override()
+dots_per_inch: Final[float] = dots_per_inch_override if dots_per_inch_override is not None else 200.
 
-unit_m = 1.
-unit_cm = 1. / 100
-unit_mm = 1. / 1000
+unit_m: Final[float] = 1.
+unit_cm: Final[float] = 1. / 100
+unit_mm: Final[float] = 1. / 1000
+unit_inch: Final[float] = 0.0254
 
 # Angle conversion
-unit_deg = float(pi / 180)
-unit_rev = 2. * pi
+unit_deg: Final[float] = 0.017453292519943295  # pi / 180, correctly rounded to double precision
+unit_rev: Final[float] = 6.283185307179586  # 2 * pi
 
 # Font size
-font_size_base = 3.2 * unit_mm
-line_width_base = 0.2 * unit_mm
+font_size_base: Final[float] = 3.2 * unit_mm
+line_width_base: Final[float] = 0.2 * unit_mm
@@ -29,17 +29,40 @@ References:
 """
 
 import argparse
+import functools
+import hashlib
 import io
-import glob
 import logging
-import os
+import struct
 import sys
 
-from typing import Dict, List, Optional, Sequence
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from graphics_context import GraphicsContext, GraphicsPage
+from graphics_context import GraphicsContext, GraphicsPage, path_move_to, path_line_to, path_curve_to, \
+    path_close_path
+from graphics_context_constants import unit_inch, dots_per_inch_override
 import spritefile, spr2img
-import temporary_directory
+
+# Pre-compiled decoders for the little-endian unsigned integers which make up most of a Drawfile
+_u32 = struct.Struct("<I").unpack_from
+_u64 = struct.Struct("<Q").unpack_from
+
+# Decoder for the 40-byte file header: Draw ID, major and minor version, generator, and bounding box
+_file_header = struct.Struct("<4sII12siiii").unpack_from
+
+# Decoder for object headers which include a bounding box: type, size and bounding box
+_object_header_bbox = struct.Struct("<IIiiii").unpack_from
+
+# Decoder for the header of a dash pattern: offset to start, and number of elements
+_dash_pattern_header = struct.Struct("<II").unpack_from
+
+# Encoder for the header of a sprite area, used to wrap the sprites embedded within Drawfiles
+_sprite_area_header = struct.Struct("<III").pack
+
+# Decoders for the coordinate pairs which follow the type word of each path element. Drawfile coordinates are
+# signed, like the bounding boxes above.
+_i32x2 = struct.Struct("<ii").unpack_from
+_i32x6 = struct.Struct("<iiiiii").unpack_from
 
 
 def bytes_to_uint(size: int, byte_array: bytes, position: int) -> int:
@@ -55,10 +78,11 @@ def bytes_to_uint(size: int, byte_array: bytes, position: int) -> int:
     :return:
         Integer value
     """
-    out = 0
-    for index in range(size):
-        out = out | (byte_array[position + index] << (index * 8))
-    return out
+    if size == 4:
+        return _u32(byte_array, position)[0]
+    if size == 8:
+        return _u64(byte_array, position)[0]
+    return int.from_bytes(byte_array[position:position + size], byteorder="little")
 
 
 def colour_dict_from_int(uint: int) -> dict:
@@ -79,9 +103,30 @@ def colour_dict_from_int(uint: int) -> dict:
     }
 
 
+def string_from_bytes(value) -> str:
+    """
+    Decode a string field of a Drawfile object. String fields are stored in object metadata as raw bytes, and are
+    only decoded when they are needed.
+
+    :param value:
+        The raw bytes of the string. Values which have already been decoded are returned unchanged.
+    :return:
+        The decoded string, with any padding removed
+    """
+    if isinstance(value, bytes):
+        return value.decode(encoding='iso-8859-1', errors='replace').strip()
+    return value
+
+
+# Lookup table converting 8-bit colour components into Cairo's 0-1 range
+_byte_to_float: Tuple[float, ...] = tuple(i / 255. for i in range(256))
+
+
+@functools.lru_cache(maxsize=1024)
 def context_colour_from_int(uint: int) -> Sequence[float]:
     """
-    Fetch a Cairo RGBA colour from a 32-bit int.
+    Fetch a Cairo RGBA colour from a 32-bit int. Drawfiles typically use only a handful of distinct colours, so
+    results are cached.
 
     :param uint:
         Integer colour specification
@@ -89,15 +134,68 @@ def context_colour_from_int(uint: int) -> Sequence[float]:
         Sequence of RGBA components, in the range 0-1
     """
 
-    colour_dict: dict = colour_dict_from_int(uint=uint)
+    return (_byte_to_float[(uint >> 8) & 0xFF], _byte_to_float[(uint >> 16) & 0xFF],
+            _byte_to_float[(uint >> 24) & 0xFF], 0. if (uint & 0xFF) == 0xFF else 1.)
 
-    return [colour_dict["r"] / 255., colour_dict["g"] / 255., colour_dict["b"] / 255.,
-            0. if colour_dict["transparent"] else 1.]
+
+# Scaling factor applied to signed 16.16 fixed-point numbers
+fixed_point_scale: float = 1. / 65536
+
+
+def compile_field_layout(fields: Dict[str, list]) -> dict:
+    """
+    Compile the field descriptions of a Drawfile object type into struct decoders, so that all the numeric fields of
+    an object can be read with a single call, rather than one call per field.
+
+    :param fields:
+        Dictionary of field descriptions, in the format used by <DrawFileRender.object_types>
+    :return:
+        Dictionary describing the compiled layout. <runs> is a list of (offset, unpacker, field names) tuples, each
+        of which decodes a contiguous run of numeric fields; <fixed_point> lists the fields which need converting from
+        fixed-point; <strings> is a list of (field name, offset, length) tuples.
+    """
+    runs: list = []
+    fixed_point: List[str] = []
+    strings: list = []
+
+    # Numeric fields are packed into runs of consecutive struct items. A field which overlaps the one before it
+    # starts a new run.
+    run_start: Optional[int] = None
+    run_format: str = ""
+    run_names: List[str] = []
+    cursor: int = 0
+
+    for field_name, (offset, field_type, size) in fields.items():
+        if field_type == "str":
+            strings.append((field_name, offset, size))
+            continue
+        if run_start is None or offset < cursor:
+            if run_start is not None:
+                runs.append((run_start, struct.Struct("<" + run_format).unpack_from, run_names))
+            run_start, run_format, run_names, cursor = offset, "", [], offset
+        if field_type == "int/65536":
+            # Fixed-point numbers are read as signed integers, and scaled afterwards
+            run_format += "x" * (offset - cursor) + {4: "i", 8: "q"}[size]
+            fixed_point.append(field_name)
+        else:
+            run_format += "x" * (offset - cursor) + {4: "I", 8: "Q"}[size]
+        run_names.append(field_name)
+        cursor = offset + size
+
+    if run_start is not None:
+        runs.append((run_start, struct.Struct("<" + run_format).unpack_from, run_names))
+
+    return {
+        "runs": runs,
+        "fixed_point": fixed_point,
+        "strings": strings
+    }
 
 
 class DrawFileRender:
     # Draw files measure positions in units of 1/(180*256) inches
-    pixel: float = 5.51215278e-07  # metres
+    units_per_inch: int = 180 * 256
+    pixel: float = unit_inch / units_per_inch  # metres
 
     # Margin to allow around the image area / metres
     margin: float = 0.005
@@ -270,27 +368,50 @@ class DrawFileRender:
         },
     }
 
+    # The properties of each object type which fetch_object needs, as tuples of (name, has bounding box, include
+    # bounding box in render, pre-compiled field layout, children start), so that each object needs only a single
+    # lookup
+    object_type_table: Dict[int, tuple] = {
+        type_id: (type_info["name"],
+                  type_info["bbox"],
+                  type_info["bbox_include_in_render"],
+                  compile_field_layout(fields=type_info["fields"]) if "fields" in type_info else None,
+                  type_info.get("children_start"))
+        for type_id, type_info in object_types.items()
+    }
+
+    # Types of path element, mapping the type word of each element onto its name, the decoder for the coordinates
+    # which follow the type word, the names of those coordinates, and the total length of the element in bytes
+    path_element_types: Dict[int, tuple] = {
+        0: ('END', None, (), 4),
+        2: ('MOVE', _i32x2, ('x', 'y'), 12),
+        5: ('CLOSE', None, (), 4),
+        6: ('BEZIER', _i32x6, ('x0', 'y0', 'x1', 'y1', 'x2', 'y2'), 28),
+        8: ('LINE', _i32x2, ('x', 'y'), 12)
+    }
+
     def __init__(self, filename: str):
         self.filename: str = filename
 
+        # The margin around the image area, in Drawfile units
+        self.margin_units: float = self.margin / self.pixel
+
+        # Cache of the images into which we have converted sprites, or the messages of the errors raised when they
+        # could not be converted, indexed by a hash of the sprite's bytes
+        self.sprite_cache: Dict[bytes, object] = {}
+
         # Read Drawfile into an array of bytes
         with open(filename, "rb") as file:
             self.bytes = file.read()
 
-        # Read header of Drawfile
+        # Read header of Drawfile, including its bounding box
+        # We will expand the limits of the bounding box if we find objects outside the visible area, so keep a
+        # record of what the header said
         self.size: int = len(self.bytes)
-        self.draw_id: str = self.bytes[0:4].decode(encoding='iso-8859-1', errors='ignore')
-        self.major_version: int = bytes_to_uint(size=4, byte_array=self.bytes, position=4)
-        self.minor_version: int = bytes_to_uint(size=4, byte_array=self.bytes, position=8)
-        self.generator: str = self.bytes[12:24].decode(encoding='iso-8859-1', errors='ignore')
-
-        # Read bounding box
-        # We will expand the limits above if we find objects outside the visible area, so keep a record of what
-        # the header said
-        self.x_min_as_read: int = bytes_to_uint(size=4, byte_array=self.bytes, position=24)
-        self.y_min_as_read: int = bytes_to_uint(size=4, byte_array=self.bytes, position=28)
-        self.x_max_as_read: int = bytes_to_uint(size=4, byte_array=self.bytes, position=32)
-        self.y_max_as_read: int = bytes_to_uint(size=4, byte_array=self.bytes, position=36)
+        (draw_id, self.major_version, self.minor_version, generator,
+         self.x_min_as_read, self.y_min_as_read, self.x_max_as_read, self.y_max_as_read) = _file_header(self.bytes, 0)
+        self.draw_id: str = draw_id.decode(encoding='iso-8859-1', errors='ignore')
+        self.generator: str = generator.decode(encoding='iso-8859-1', errors='ignore')
 
         # We will expand the limits above if we find objects outside the visible area, so keep a record of what
         # the header said
@@ -323,10 +444,11 @@ class DrawFileRender:
             Position, Drawfile pixels
         """
 
-        self.x_min = min(self.x_min, int(x - self.margin / self.pixel))
-        self.x_max = max(self.x_max, int(x + self.margin / self.pixel))
-        self.y_min = min(self.y_min, int(y - self.margin / self.pixel))
-        self.y_max = max(self.y_max, int(y + self.margin / self.pixel))
+        margin: float = self.margin_units
+        self.x_min = min(self.x_min, int(x - margin))
+        self.x_max = max(self.x_max, int(x + margin))
+        self.y_min = min(self.y_min, int(y - margin))
+        self.y_max = max(self.y_max, int(y + margin))
 
     def x_pos(self, x: float) -> float:
         """
@@ -363,19 +485,26 @@ class DrawFileRender:
         :return:
             None
         """
-        while position < end_position:
-            new_object = self.fetch_object(position=position, exit_on_zero=exit_on_zero)
-            if new_object is None:
-                break
-            target.append(new_object)
-            position += new_object["size"]
+        # Lists of objects which remain to be read. Rather than recursing into objects which have children,
+        # fetch_object adds their lists of children to this stack.
+        pending: List[tuple] = [(target, position, end_position, exit_on_zero)]
+
+        while pending:
+            target, position, end_position, exit_on_zero = pending.pop()
+            while position < end_position:
+                new_object = self.fetch_object(position=position, exit_on_zero=exit_on_zero, pending=pending)
+                if new_object is None:
+                    break
+                target.append(new_object)
+                position += new_object["size"]
 
-            # Impose a minimum size on an object, as otherwise infinite recursion is possible
-            if new_object["size"] < 8:
-                logging.info("Drawfile object with illegal size of {:d} bytes".format(new_object["size"]))
-                break
+                # Impose a minimum size on an object, as otherwise infinite recursion is possible
+                if new_object["size"] < 8:
+                    logging.info("Drawfile object with illegal size of {:d} bytes".format(new_object["size"]))
+                    break
 
-    def fetch_object(self, position: int, exit_on_zero: bool = False) -> Optional[Dict]:
+    def fetch_object(self, position: int, exit_on_zero: bool = False,
+                     pending: Optional[List[tuple]] = None) -> Optional[Dict]:
         """
         Fetch a single object from the Drawfile.
 
@@ -383,11 +512,16 @@ class DrawFileRender:
             The position of the start of this object
         :param exit_on_zero:
             Exit if an object begins with a null word
+        :param pending:
+            If supplied, the children of this object are not read immediately. Instead, the arguments needed to read
+            them with fetch_objects are appended to this list, for the caller to process.
         :return:
             A dictionary describing the object we extracted
         """
-        # Read the object header
-        type_id_32: int = bytes_to_uint(size=4, byte_array=self.bytes, position=position)
+        data: bytes = self.bytes
+
+        # Read the object type on its own, as a list of objects may end with a single null word at the end of the file
+        type_id_32: int = _u32(data, position)[0]
 
         # Draw Plus stores other flags in most significant 24 bits, so ignore these in determining object type
         type_id: int = type_id_32 & 0xFF
@@ -396,67 +530,76 @@ class DrawFileRender:
         if type_id == 0 and exit_on_zero:
             return None
 
-        # Create dictionary describing the object we are reading
-        size: int = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 4)
-        new_object = {
-            "type_id": type_id_32,
-            "position": position,
-            "size": size,
-            "metadata": {}
-        }
+        size: int = _u32(data, position + 4)[0]
 
         # If this object is of an unknown type, we ignore it
-        if type_id not in self.object_types:
-            new_object["type_name"] = "Undefined type {:d}".format(type_id)
-            return new_object
-
-        # Populate the name of the type of this object
-        type_info: dict = self.object_types[type_id]
-        new_object["type_name"] = type_info["name"]
-
-        # Populate the bounding box of this object
-        if type_info["bbox"]:
-            new_object["x_min"] = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 8)
-            new_object["y_min"] = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 12)
-            new_object["x_max"] = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 16)
-            new_object["y_max"] = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 20)
+        type_info: Optional[tuple] = self.object_type_table.get(type_id)
+        if type_info is None:
+            return {
+                "type_id": type_id_32,
+                "position": position,
+                "size": size,
+                "type_name": "Undefined type {:d}".format(type_id),
+                "metadata": {}
+            }
+        type_name, has_bbox, bbox_include_in_render, layout, children_start = type_info
+
+        # Create dictionary describing the object we are reading, with all of its header fields populated at once
+        if has_bbox:
+            _, _, x_min, y_min, x_max, y_max = _object_header_bbox(data, position)
+            new_object = {
+                "type_id": type_id_32,
+                "position": position,
+                "size": size,
+                "type_name": type_name,
+                "x_min": x_min,
+                "y_min": y_min,
+                "x_max": x_max,
+                "y_max": y_max,
+                "metadata": {}
+            }
 
-            if type_info["bbox_include_in_render"]:
-                self.factor_into_bbox(x=new_object["x_min"], y=new_object["y_min"])
-                self.factor_into_bbox(x=new_object["x_max"], y=new_object["y_max"])
+            if bbox_include_in_render:
+                self.factor_into_bbox(x=x_min, y=y_min)
+                self.factor_into_bbox(x=x_max, y=y_max)
 
             payload_start: int = position + 24
         else:
+            new_object = {
+                "type_id": type_id_32,
+                "position": position,
+                "size": size,
+                "type_name": type_name,
+                "metadata": {}
+            }
+
             payload_start: int = position + 8
 
         # Read fields
-        if "fields" in type_info:
-            for field_name, field_props in type_info["fields"].items():
-                value = None
-                if field_props[1] == "uint":
-                    # Unsigned integer
-                    value = bytes_to_uint(byte_array=self.bytes, size=field_props[2],
-                                          position=payload_start + field_props[0])
-                if field_props[1] == "int/65536":
-                    # Fixed-point number &XXXX.XXXX
-                    value = bytes_to_uint(byte_array=self.bytes, size=field_props[2],
-                                          position=payload_start + field_props[0]) / 65536.
-                    # Deal with negative values
-                    if value > 0x8000:
-                        value -= 0x10000
-                elif field_props[1] == "str":
-                    if field_props[2] > 0:
-                        # String of pre-defined length
-                        start = payload_start + field_props[0]
-                        value = self.bytes[start:start + field_props[2]].decode(encoding='iso-8859-1', errors='replace')
-                    else:
-                        # Null-terminated string
-                        start = payload_start + field_props[0]
-                        value = self.bytes[start:].split(b"\x00")[0].decode(encoding='iso-8859-1', errors='replace')
-                    # Remove padding
-                    value = value.strip()
-                # Set metadata item value
-                new_object["metadata"][field_name] = value
+        if layout is not None:
+            metadata: dict = new_object["metadata"]
+
+            # Numeric fields
+            for offset, unpack, field_names in layout["runs"]:
+                metadata.update(zip(field_names, unpack(data, payload_start + offset)))
+
+            # Fixed-point numbers &XXXX.XXXX
+            for field_name in layout["fixed_point"]:
+                metadata[field_name] *= fixed_point_scale
+
+            # Strings. These are stored as raw bytes, and decoded by string_from_bytes only when they are used.
+            for field_name, offset, length in layout["strings"]:
+                start = payload_start + offset
+                if length > 0:
+                    # String of pre-defined length
+                    metadata[field_name] = data[start:start + length]
+                else:
+                    # Null-terminated string. Search for the terminator rather than splitting, which would copy
+                    # the whole of the rest of the file.
+                    end: int = data.find(b"\x00", start)
+                    if end < 0:
+                        end = len(data)
+                    metadata[field_name] = data[start:end]
 
         # Read path components
         if type_id == 2:
@@ -469,15 +612,21 @@ class DrawFileRender:
             else:
                 payload_start: int = position + 40
 
-            new_object["path"] = self.fetch_path(position=payload_start)
+            # The bounding box of a path object has already been factored into that of the Drawfile, so points
+            # which lie within it need not be factored in again
+            new_object["path"] = self.fetch_path(position=payload_start,
+                                                 bbox=(x_min, y_min, x_max, y_max) if bbox_include_in_render else None)
 
         # Read any children this object may have
-        if "children_start" in type_info:
+        if children_start is not None:
             new_object["children"] = []
-            self.fetch_objects(target=new_object["children"],
-                               position=payload_start + type_info["children_start"],
-                               end_position=position + size,
-                               exit_on_zero=True)
+            if pending is not None:
+                pending.append((new_object["children"], payload_start + children_start, position + size, True))
+            else:
+                self.fetch_objects(target=new_object["children"],
+                                   position=payload_start + children_start,
+                                   end_position=position + size,
+                                   exit_on_zero=True)
 
         # Return this object
         return new_object
@@ -493,8 +642,7 @@ class DrawFileRender:
         """
 
         # Create dictionary describing the dash pattern we are reading
-        start: int = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 0)
-        item_count: int = bytes_to_uint(size=4, byte_array=self.bytes, position=position + 4)
+        start, item_count = _dash_pattern_header(self.bytes, position)
         new_object = {
             "start": start,
             "item_count": item_count,
@@ -505,77 +653,69 @@ class DrawFileRender:
         size: int = 8 + 4 * item_count
         new_object["size"] = size
 
-        # Read dash pattern
-        new_object["sequence"] = [bytes_to_uint(size=4, byte_array=self.bytes, position=position + 8 + 4 * index)
-                                  for index in range(item_count)]
+        # Read dash pattern, decoding all of its elements in a single call
+        new_object["sequence"] = list(struct.unpack_from("<{:d}I".format(item_count), self.bytes, position + 8))
 
         # Return this dash pattern descriptor
         return new_object
 
-    def fetch_path(self, position: int) -> List[Dict]:
+    def fetch_path(self, position: int, bbox: Optional[Sequence[int]] = None) -> List[Dict]:
         """
         Fetch a path from within a path object.
 
         :param position:
             The byte position of the start of the path
+        :param bbox:
+            Optionally, a bounding box (x_min, y_min, x_max, y_max) which has already been factored into the bounding
+            box of the Drawfile. If the path lies entirely within it, the path's own extent is not factored in.
         :return:
             List of dictionaries of properties
         """
 
         new_path: List[Dict] = []
 
-        terminate: bool = False
-        while not terminate:
-            element_type: int = bytes_to_uint(size=4, byte_array=self.bytes, position=position)
-
-            length: Optional[int] = None
-            new_component: Optional[dict] = None
-            if element_type == 0:
-                new_component = {'type': 'END'}
-                length = 4
-                terminate = True
-            elif element_type == 2:
-                new_component = {'type': 'MOVE',
-                                 'x': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 4),
-                                 'y': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 8)
-                                 }
-                self.factor_into_bbox(x=new_component['x'], y=new_component['y'])
-                length = 12
-            elif element_type == 5:
-                new_component = {'type': 'CLOSE'}
-                length = 4
-            elif element_type == 6:
-                new_component = {'type': 'BEZIER',
-                                 'x0': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 4),
-                                 'y0': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 8),
-                                 'x1': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 12),
-                                 'y1': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 16),
-                                 'x2': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 20),
-                                 'y2': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 24),
-                                 }
-                self.factor_into_bbox(x=new_component['x0'], y=new_component['y0'])
-                self.factor_into_bbox(x=new_component['x1'], y=new_component['y1'])
-                self.factor_into_bbox(x=new_component['x2'], y=new_component['y2'])
-                length = 28
-            elif element_type == 8:
-                new_component = {'type': 'LINE',
-                                 'x': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 4),
-                                 'y': bytes_to_uint(size=4, byte_array=self.bytes, position=position + 8)
-                                 }
-                self.factor_into_bbox(x=new_component['x'], y=new_component['y'])
-                length = 12
+        # Collect the coordinates of all the points on the path, so that they can be factored into the bounding box
+        # in one go once the whole path has been read
+        x_points: List[int] = []
+        y_points: List[int] = []
+
+        data: bytes = self.bytes
+        element_types: Dict[int, tuple] = self.path_element_types
+
+        while True:
+            element: Optional[tuple] = element_types.get(_u32(data, position)[0])
 
             # If we got an item we can't parse, then finish gracefully
-            if length is None:
-                new_component = {'type': 'ILLEGAL'}
-                length = 4
-                terminate = True
+            if element is None:
+                new_path.append({'type': 'ILLEGAL'})
+                break
+
+            type_name, unpack, coordinate_names, length = element
+            new_component: dict = {'type': type_name}
+            if unpack is not None:
+                coordinates: tuple = unpack(data, position + 4)
+                new_component.update(zip(coordinate_names, coordinates))
+                x_points.extend(coordinates[0::2])
+                y_points.extend(coordinates[1::2])
 
             # Add this path element to the chain
             new_path.append(new_component)
+            if type_name == 'END':
+                break
+
             # Advance to next path element
             position += length
 
+        # Factor the extent of the path into the bounding box of the Drawfile
+        if x_points:
+            path_x_min, path_y_min = min(x_points), min(y_points)
+            path_x_max, path_y_max = max(x_points), max(y_points)
+            if not (bbox is not None and
+                    bbox[0] <= path_x_min and bbox[1] <= path_y_min and
+                    path_x_max <= bbox[2] and path_y_max <= bbox[3]):
+                self.factor_into_bbox(x=path_x_min, y=path_y_min)
+                self.factor_into_bbox(x=path_x_max, y=path_y_max)
+
         # Return this path
         return new_path
 
@@ -590,12 +730,27 @@ class DrawFileRender:
         :return:
             str
         """
-        output = ""
-        tab = "    " * indent
-        output += "{:s}* Path has {:d} elements: {}\n".format(tab, len(item), repr(item))
+        output: List[str] = []
+        self.write_path_description(item=item, output=output, indent=indent)
 
         # Return string describing this path
-        return output
+        return "".join(output)
+
+    def write_path_description(self, item: list, output: List[str], indent: int = 0) -> None:
+        """
+        Append lines of text describing the internal structure of a single path within a Drawfile to a list.
+
+        :param item:
+            The list of elements describing the path we are to describe.
+        :param output:
+            The list of strings to which we should append our description.
+        :param indent:
+            The number of indentation levels to the left of the text.
+        :return:
+            None
+        """
+        tab = "    " * indent
+        output.append("{:s}* Path has {:d} elements: {}\n".format(tab, len(item), repr(item)))
 
     def describe_object(self, item: dict, indent: int = 0) -> str:
         """
@@ -608,36 +763,55 @@ class DrawFileRender:
         :return:
             str
         """
-        output: str = ""
+        output: List[str] = []
+        self.write_object_description(item=item, output=output, indent=indent)
+
+        # Return string describing this object
+        return "".join(output)
+
+    def write_object_description(self, item: dict, output: List[str], indent: int = 0) -> None:
+        """
+        Append lines of text describing the internal structure of a single object within a Drawfile to a list. The
+        text is accumulated in a list, rather than by string concatenation, so that the cost of describing a file is
+        linear in its size.
+
+        :param item:
+            The dictionary describing the object we are to describe.
+        :param output:
+            The list of strings to which we should append our description.
+        :param indent:
+            The number of indentation levels to the left of the text.
+        :return:
+            None
+        """
         tab: str = "    " * indent
-        output += "{:s}* Object <{:s}>\n".format(tab, item["type_name"])
-        output += "{:s}    * Type id       : {:08X}\n".format(tab, item["type_id"])
-        output += "{:s}    * Byte position : {:d}\n".format(tab, item["position"])
-        output += "{:s}    * Byte size     : {:d}\n".format(tab, item["size"])
+        output.append("{:s}* Object <{:s}>\n".format(tab, item["type_name"]))
+        output.append("{:s}    * Type id       : {:08X}\n".format(tab, item["type_id"]))
+        output.append("{:s}    * Byte position : {:d}\n".format(tab, item["position"]))
+        output.append("{:s}    * Byte size     : {:d}\n".format(tab, item["size"]))
 
         # Render object bounding box
         if "x_min" in item:
-            output += "{:s}    * Bounding box X: {:8d} -> {:8d}\n".format(tab, item["x_min"], item["x_max"])
-            output += "{:s}    * Bounding box Y: {:8d} -> {:8d}\n".format(tab, item["y_min"], item["y_max"])
+            output.append("{:s}    * Bounding box X: {:8d} -> {:8d}\n".format(tab, item["x_min"], item["x_max"]))
+            output.append("{:s}    * Bounding box Y: {:8d} -> {:8d}\n".format(tab, item["y_min"], item["y_max"]))
 
         # Render object metadata
         for item_key in sorted(item["metadata"].keys()):
             item_value = item["metadata"][item_key]
             if "colour" in item_key.lower():
                 item_value = "{:08X}".format(item_value)
-            output += "{:s}    * {:14s}: {}\n".format(tab, item_key, str(item_value))
+            elif isinstance(item_value, bytes):
+                item_value = string_from_bytes(value=item_value)
+            output.append("{:s}    * {:14s}: {}\n".format(tab, item_key, str(item_value)))
 
         # Render path, if present
         if "path" in item:
-            output += self.describe_path(item=item["path"], indent=indent + 1)
+            self.write_path_description(item=item["path"], output=output, indent=indent + 1)
 
         # Render object children
         if "children" in item:
             for item in item["children"]:
-                output += self.describe_object(item=item, indent=indent + 1)
-
-        # Return string describing this object
-        return output
+                self.write_object_description(item=item, output=output, indent=indent + 1)
 
     def describe_contents(self) -> str:
         """
@@ -646,27 +820,94 @@ class DrawFileRender:
         :return:
             str
         """
-        output = ""
-        output += "File size     : {:d} bytes\n".format(self.size)
-        output += "Draw ID       : {:s}\n".format(self.draw_id)
-        output += "Major version : {:d}\n".format(self.major_version)
-        output += "Minor version : {:d}\n".format(self.minor_version)
-        output += "Generator     : {:s}\n".format(self.generator)
-        output += "Bounding box X: {:8d} -> {:8d}\n".format(self.x_min_as_read, self.x_max_as_read)
-        output += "Bounding box Y: {:8d} -> {:8d}\n".format(self.y_min_as_read, self.y_max_as_read)
-        output += "Bounding box X: {:8d} -> {:8d} (computed)\n".format(self.x_min, self.x_max)
-        output += "Bounding box Y: {:8d} -> {:8d} (computed)\n".format(self.y_min, self.y_max)
+        output: List[str] = [
+            "File size     : {:d} bytes\n".format(self.size),
+            "Draw ID       : {:s}\n".format(self.draw_id),
+            "Major version : {:d}\n".format(self.major_version),
+            "Minor version : {:d}\n".format(self.minor_version),
+            "Generator     : {:s}\n".format(self.generator),
+            "Bounding box X: {:8d} -> {:8d}\n".format(self.x_min_as_read, self.x_max_as_read),
+            "Bounding box Y: {:8d} -> {:8d}\n".format(self.y_min_as_read, self.y_max_as_read),
+            "Bounding box X: {:8d} -> {:8d} (computed)\n".format(self.x_min, self.x_max),
+            "Bounding box Y: {:8d} -> {:8d} (computed)\n".format(self.y_min, self.y_max)
+        ]
 
         for item in self.objects:
-            output += self.describe_object(item=item)
+            self.write_object_description(item=item, output=output)
+
+        return "".join(output)
+
+    def sprite_bytes(self, item: dict) -> bytes:
+        """
+        Extract the bytes of the sprite contained within a sprite object.
+
+        :param item:
+            The dictionary describing the sprite object
+        :return:
+            The bytes of the sprite
+        """
+        if item['type_name'] == "Sprite object":
+            preface_size = 24
+        else:
+            preface_size = 48
+        block_position = item["position"] + preface_size  # Start of sprite data
+        block_size = item["size"] - preface_size  # Number of bytes of sprite data
+        return self.bytes[block_position:block_position + block_size]
+
+    def sprite_to_image(self, sprite_bytes: bytes):
+        """
+        Convert a sprite embedded within a Drawfile into a PIL Image object. Conversions are cached by the content of
+        the sprite, so that sprites which appear many times within a Drawfile are only converted once. Failed
+        conversions are cached too, and raise an error with the same message without decoding the sprite again.
 
-        return output
+        :param sprite_bytes:
+            The bytes of the sprite, as stored within the Drawfile
+        :return:
+            A PIL Image object containing the sprite
+        """
+        cache_key: bytes = hashlib.blake2b(sprite_bytes, digest_size=16).digest()
+        if cache_key in self.sprite_cache:
+            cached = self.sprite_cache[cache_key]
+            if isinstance(cached, str):
+                # Raise a fresh error, as re-raising the original would extend its traceback every time
+                raise spritefile.spritefile_error(cached)
+            return cached
+
+        try:
+            # Construct a sprite file containing this sprite. The header gives the number of sprites in the area, the
+            # offset to the first sprite, and the offset to the first free word in the area (i.e. after the last
+            # sprite)
+            free = _u32(sprite_bytes, 0)[0] + 0x10
+            sprite_file_handle = io.BytesIO(_sprite_area_header(1, 0x10, free) + sprite_bytes)
+
+            # Convert it into a sprite object, and then into an image
+            sprite = spritefile.spritefile(file=sprite_file_handle)
+            image = list(spr2img.sprites_to_images(spr=sprite).values())[0]
+        except Exception as e:
+            self.sprite_cache[cache_key] = str(e)
+            raise
+
+        self.sprite_cache[cache_key] = image
+        return image
+
+    def render_object(self, item: dict, context: GraphicsContext, pending: Optional[List[dict]] = None) -> None:
+        """
+        Render a single object from this Drawfile, together with its children.
 
-    def render_object(self, item: dict, context: GraphicsContext) -> None:
+        :param item:
+            The dictionary describing the object we are to render.
+        :param context:
+            The graphics context we are to render the object onto.
+        :param pending:
+            If supplied, the children of this object are not rendered immediately. Instead, they are pushed onto this
+            stack of objects, for the caller to render in turn.
+        :return:
+            None
+        """
         # Render text objects
         if item['type_name'] in ("Text object", "Transformed text object"):
             context.set_font_size(font_size=1)
-            text_string: str = item["metadata"]["text"]
+            text_string: str = string_from_bytes(value=item["metadata"]["text"])
             text_extent = context.measure_text(text=text_string)
             if text_extent["width"] == 0:
                 logging.info("Ignoring text item <{}> with zero width".format(text_string))
@@ -675,7 +916,6 @@ class DrawFileRender:
             x_centre: float = self.x_pos(x=(item["x_max"] + item["x_min"]) / 2)
             y_centre: float = self.y_pos(y=(item["y_max"] + item["y_min"]) / 2)
             target_width: float = (item["x_max"] - item["x_min"]) * self.pixel
-            target_height: float = (item["y_max"] - item["y_min"]) * self.pixel
             context.set_color(color=text_colour)
             if item['type_name'] == "Transformed text object":
                 # Apply transformation to sprite
@@ -687,13 +927,10 @@ class DrawFileRender:
                                                   centre_x=x_centre, centre_y=y_centre
                                                   )
 
-                # Work out the correct scaling to fill the bounding box
-                corners = [(0.5 * sgn_x, 0.5 * sgn_y) for sgn_x in (-1, 1) for sgn_y in (-1, 1)]
-                corners_transformed = [(p[0] * xx + p[1] * xy, p[0] * yx + p[1] * yy) for p in corners]
-                transformed_unit_width = (max([p[0] for p in corners_transformed]) -
-                                          min([p[0] for p in corners_transformed]))
-                target_width_transformed = target_width / transformed_unit_width
-                target_height_transformed = target_height / transformed_unit_width
+                # Work out the correct scaling to fill the bounding box. A unit square centred on the origin has
+                # a width of |xx| + |xy| after transformation. The text is scaled by width alone.
+                transformed_unit_width: float = abs(xx) + abs(xy)
+                target_width_transformed: float = target_width / transformed_unit_width
 
                 # Paint text
                 font_size: float = target_width_transformed / text_extent["width"]
@@ -707,26 +944,53 @@ class DrawFileRender:
                 context.set_font_size(font_size=font_size)
                 context.text(text=text_string, h_align=0, v_align=0, gap=0, rotation=0, x=x_centre, y=y_centre)
 
-        # Render path objects
-        if item['type_name'] == "Path object":
+        # Render path objects. Paths whose fill and outline are both transparent are invisible, so they are skipped
+        # without building them. A colour is transparent when its least significant byte is 0xFF.
+        if item['type_name'] == "Path object" and ((item['metadata']['fill_colour'] & 0xFF) != 0xFF or
+                                                   (item['metadata']['outline_colour'] & 0xFF) != 0xFF):
             # Start path
             context.begin_path()
 
-            # Trace path, point by point
+            # The conversion into page coordinates performed by x_pos and y_pos is inlined below, since it is
+            # invariant over the whole path
+            x_min: int = self.x_min
+            y_max: int = self.y_max
+            pixel: float = self.pixel
+
+            # Convert the path into a list of elements which can be passed to Cairo in a single call. Cairo's
+            # path data cannot express begin_sub_path, which we use after closing each sub-path, so instead we keep
+            # track of whether there is a current point, and start with a move wherever there isn't one, which is
+            # what Cairo would do with an isolated line or curve.
+            path_data: list = []
+            has_current_point: bool = False
             for path_item in item['path']:
-                if path_item['type'] == 'END':
+                path_item_type: str = path_item['type']
+                if path_item_type == 'LINE':
+                    path_data.append((path_line_to if has_current_point else path_move_to,
+                                      ((path_item['x'] - x_min) * pixel, (y_max - path_item['y']) * pixel)))
+                    has_current_point = True
+                elif path_item_type == 'BEZIER':
+                    x0: float = (path_item['x0'] - x_min) * pixel
+                    y0: float = (y_max - path_item['y0']) * pixel
+                    if not has_current_point:
+                        path_data.append((path_move_to, (x0, y0)))
+                    path_data.append((path_curve_to,
+                                      (x0, y0,
+                                       (path_item['x1'] - x_min) * pixel, (y_max - path_item['y1']) * pixel,
+                                       (path_item['x2'] - x_min) * pixel, (y_max - path_item['y2']) * pixel)))
+                    has_current_point = True
+                elif path_item_type == 'MOVE':
+                    path_data.append((path_move_to,
+                                      ((path_item['x'] - x_min) * pixel, (y_max - path_item['y']) * pixel)))
+                    has_current_point = True
+                elif path_item_type == 'CLOSE':
+                    path_data.append((path_close_path, ()))
+                    has_current_point = False
+                elif path_item_type == 'END':
                     break
-                elif path_item['type'] == 'MOVE':
-                    context.move_to(x=self.x_pos(x=path_item['x']), y=self.y_pos(y=path_item['y']))
-                elif path_item['type'] == 'CLOSE':
-                    context.close_path()
-                    context.begin_sub_path()
-                elif path_item['type'] == 'BEZIER':
-                    context.curve_to(x0=self.x_pos(x=path_item['x0']), y0=self.y_pos(y=path_item['y0']),
-                                     x1=self.x_pos(x=path_item['x1']), y1=self.y_pos(y=path_item['y1']),
-                                     x2=self.x_pos(x=path_item['x2']), y2=self.y_pos(y=path_item['y2']))
-                elif path_item['type'] == 'LINE':
-                    context.line_to(x=self.x_pos(x=path_item['x']), y=self.y_pos(y=path_item['y']))
+
+            # Trace path
+            context.append_path(path=path_data)
 
             # Fill path
             fill_colour = context_colour_from_int(uint=item['metadata']['fill_colour'])
@@ -735,103 +999,117 @@ class DrawFileRender:
 
             # Stroke path
             stroke_colour = context_colour_from_int(uint=item['metadata']['outline_colour'])
-            outline_width = max(2, item['metadata']['outline_width'] * self.pixel / context.base_line_width)
             if stroke_colour[3] > 0:
+                # Impose a minimum line width of two base line widths
+                outline_width: float = item['metadata']['outline_width'] * self.pixel / context.base_line_width
+                if outline_width < 2:
+                    outline_width = 2
                 context.stroke(color=stroke_colour, line_width=outline_width,
                                dotted=item['metadata']['has_dash_pattern'])
 
         # Render sprite objects
         if item['type_name'] in ("Sprite object", "Transformed sprite object"):
-            if item['type_name'] == "Sprite object":
-                preface_size = 24
-            else:
-                preface_size = 48
-            block_position = item["position"] + preface_size  # Start of sprite data
-            block_size = item["size"] - preface_size  # Number of bytes of sprite data
-            sprite_bytes = self.bytes[block_position:block_position + block_size]
-
-            # Construct a sprite file containing this sprite
-            sprite_file_handle = io.BytesIO()
-            # Number of sprites in area
-            sprite_file_handle.write((1).to_bytes(length=4, byteorder='little'))
-            # Offset to first sprite
-            sprite_file_handle.write((0x10).to_bytes(length=4, byteorder='little'))
-            # Offset to first free word in area (i.e. after last sprite)
-            free = bytes_to_uint(size=4, byte_array=sprite_bytes, position=0) + 0x10
-            sprite_file_handle.write(free.to_bytes(length=4, byteorder='little'))
-            # Sprite data
-            sprite_file_handle.write(sprite_bytes)
-
-            # Convert it into a sprite object
             try:
-                sprite = spritefile.spritefile(file=sprite_file_handle)
-                with temporary_directory.TemporaryDirectory() as tmp_dir:
-                    spr2img.convert_sprites(spr=sprite, output_dir=tmp_dir.tmp_dir, format="png")
-                    first_sprite = glob.glob(os.path.join(tmp_dir.tmp_dir, "*.png"))[0]
-
-                    # Render sprite
-                    if item['type_name'] == "Transformed sprite object":
-                        centre_x: float = self.x_pos((item["x_max"] + item["x_min"]) / 2)
-                        centre_y: float = self.y_pos((item["y_max"] + item["y_min"]) / 2)
-                        target_width: float = (item["x_max"] - item["x_min"]) * self.pixel
-                        target_height: float = (item["y_max"] - item["y_min"]) * self.pixel
-
-                        # Apply transformation to sprite
-                        xx: float = item["metadata"]["transformation_a"]
-                        yx: float = -item["metadata"]["transformation_b"]
-                        xy: float = -item["metadata"]["transformation_c"]
-                        yy: float = item["metadata"]["transformation_d"]
-                        context.matrix_transformation_set(xx=xx, yx=yx, xy=xy, yy=yy, x0=0, y0=0,
-                                                          centre_x=centre_x, centre_y=centre_y
-                                                          )
-
-                        # Work out the correct scaling to fill the bounding box
-                        corners = [(0.5 * sgn_x, 0.5 * sgn_y) for sgn_x in (-1, 1) for sgn_y in (-1, 1)]
-                        corners_transformed = [(p[0] * xx + p[1] * xy, p[0] * yx + p[1] * yy) for p in corners]
-                        transformed_unit_width = (max([p[0] for p in corners_transformed]) -
-                                                  min([p[0] for p in corners_transformed]))
-                        target_width_transformed = target_width / transformed_unit_width
-                        target_height_transformed = target_height / transformed_unit_width
-
-                        # Paint sprite onto the canvas
-                        context.paint_png_image(png_filename=first_sprite,
-                                                x_left=-target_width_transformed / 2,
-                                                y_top=-target_height_transformed / 2,
-                                                target_width=target_width_transformed,
-                                                target_height=target_height_transformed
-                                                )
-
-                        # Undo transformation
-                        context.matrix_transformation_restore()
-                    else:
-                        # Paint sprite onto the canvas
-                        context.paint_png_image(png_filename=first_sprite,
-                                                x_left=self.x_pos(x=item["x_min"]),
-                                                y_top=self.y_pos(y=item["y_max"]),
-                                                target_width=(item["x_max"] - item["x_min"]) * self.pixel,
-                                                target_height=(item["y_max"] - item["y_min"]) * self.pixel
-                                                )
-
-            except:
-                logging.info("Failed to render sprite")
+                # Convert the sprite into an image, or fetch it from the cache if we have seen this sprite before
+                sprite_image = self.sprite_to_image(sprite_bytes=self.sprite_bytes(item=item))
+
+                # Transformed sprites whose transformation matrix is the identity are painted in the same way as
+                # untransformed sprites, avoiding the need to set and then restore the transformation. The matrix
+                # is decoded exactly from fixed-point, so an identity matrix compares exactly equal.
+                is_transformed: bool = (item['type_name'] == "Transformed sprite object" and
+                                        (item["metadata"]["transformation_a"],
+                                         item["metadata"]["transformation_b"],
+                                         item["metadata"]["transformation_c"],
+                                         item["metadata"]["transformation_d"]) != (1, 0, 0, 1))
+
+                # Bounding box of the sprite, Drawfile units, and its size on the page, metres
+                left, bottom, right, top = item["x_min"], item["y_min"], item["x_max"], item["y_max"]
+                target_width: float = (right - left) * self.pixel
+                target_height: float = (top - bottom) * self.pixel
+
+                # Render sprite
+                if is_transformed:
+                    centre_x: float = self.x_pos(x=(right + left) * 0.5)
+                    centre_y: float = self.y_pos(y=(top + bottom) * 0.5)
+
+                    # Apply transformation to sprite
+                    xx: float = item["metadata"]["transformation_a"]
+                    yx: float = -item["metadata"]["transformation_b"]
+                    xy: float = -item["metadata"]["transformation_c"]
+                    yy: float = item["metadata"]["transformation_d"]
+                    context.matrix_transformation_set(xx=xx, yx=yx, xy=xy, yy=yy, x0=0, y0=0,
+                                                      centre_x=centre_x, centre_y=centre_y
+                                                      )
+
+                    # Work out the correct scaling to fill the bounding box. A unit square centred on the origin
+                    # has a width of |xx| + |xy| and a height of |yx| + |yy| after transformation.
+                    transformed_unit_width: float = abs(xx) + abs(xy)
+                    transformed_unit_height: float = abs(yx) + abs(yy)
+                    target_width_transformed: float = target_width / transformed_unit_width
+                    target_height_transformed: float = target_height / transformed_unit_height
+
+                    # Paint sprite onto the canvas
+                    context.paint_pil_image(image=sprite_image,
+                                            x_left=-target_width_transformed / 2,
+                                            y_top=-target_height_transformed / 2,
+                                            target_width=target_width_transformed,
+                                            target_height=target_height_transformed
+                                            )
+
+                    # Undo transformation
+                    context.matrix_transformation_restore()
+                else:
+                    # Paint sprite onto the canvas
+                    context.paint_pil_image(image=sprite_image,
+                                            x_left=self.x_pos(x=left),
+                                            y_top=self.y_pos(y=top),
+                                            target_width=target_width,
+                                            target_height=target_height
+                                            )
+
+            except Exception as e:
+                # Sprites within Drawfiles are frequently corrupt, and can fail in many ways, so we catch all errors
+                # here rather than abandoning the whole render. KeyboardInterrupt and SystemExit still propagate.
+                logging.info("Failed to render sprite: {}".format(e))
 
         # Render object children
         if "children" in item:
-            for item in item["children"]:
-                self.render_object(item=item, context=context)
+            if pending is not None:
+                # Push the children in reverse order, so that they are popped off the stack in their original order
+                pending.extend(reversed(item["children"]))
+            else:
+                for child in item["children"]:
+                    self.render_object(item=child, context=context)
 
-    def render_to_context(self, filename: str, img_format: str, dots_per_inch: float = 72.) -> None:
+    def render_to_context(self, filename: str, img_format: str, dots_per_inch: Optional[float] = None) -> None:
         """
         Render this Draw file to a graphics page.
+
+        :param filename:
+            The filename of the image file we are to produce, without file type suffix
+        :param img_format:
+            The image format we are to produce.
+        :param dots_per_inch:
+            The dots per inch resolution to render this page. If None, the resolution set by the environment
+            variable DRAWFILE_DPI is used, or 72 dpi if it is not set.
         """
 
+        if dots_per_inch is None:
+            dots_per_inch = dots_per_inch_override if dots_per_inch_override is not None else 72.
+
         with GraphicsPage(img_format=img_format, output=filename, dots_per_inch=dots_per_inch,
                           width=(self.x_max - self.x_min) * self.pixel,
                           height=(self.y_max - self.y_min) * self.pixel
                           ) as page:
             with GraphicsContext(page=page, offset_x=0, offset_y=0) as context:
-                for item in self.objects:
-                    self.render_object(item=item, context=context)
+                # Render objects in order, depth first, using an explicit stack of the objects which remain to be
+                # rendered rather than recursing into objects which have children
+                pending: List[dict] = list(reversed(self.objects))
+                while pending:
+                    self.render_object(item=pending.pop(), context=context, pending=pending)
+
+        # Release the sprites we converted while rendering
+        self.sprite_cache.clear()
 
 
 # Do it right away if we're run as a script
@@ -47,17 +47,40 @@ def list_sprites(sf, spr):
     return
 
 
-def convert_sprites(spr, output_dir, format, scaling=4):
-    # Convert each sprite to the format which uses the suffix given.
+def sprites_to_images(spr):
+    # Convert each sprite into an Image object, held in memory, without
+    # any scaling.
+    images = {}
+
     for name, sprite in list(spr.sprites.items()):
 
-        # Create an Image object.
-        image = Image.frombytes(
+        # Wrap the decoded pixel data directly, rather than first copying
+        # it into a bytes object. Data which does not support the buffer
+        # protocol, such as a list of byte values, is converted first.
+        data = sprite['image']
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+
+        images[name] = Image.frombuffer(
             sprite['mode'], (sprite['width'], sprite['height']),
-            bytes(sprite['image'])
+            data, 'raw', sprite['mode'], 0, 1
         )
 
-        image = image.resize(size=(sprite['width'] * scaling, sprite['height'] * scaling), resample=Image.NEAREST)
+    return images
+
+
+def convert_sprites(spr, output_dir, format, scaling=4):
+    # Convert each sprite to the format which uses the suffix given.
+    # Return the paths of the files written, so that callers do not need
+    # to search the output directory for them.
+    paths = []
+
+    for name, image in list(sprites_to_images(spr).items()):
+
+        # Upscale the image; there is nothing to do when no scaling is
+        # required, so the copy PIL would make is skipped.
+        if scaling != 1:
+            image = image.resize(size=(image.width * scaling, image.height * scaling), resample=Image.NEAREST)
 
         # Write the image to a file in the output directory.
         path = "?"
@@ -69,6 +92,8 @@ def convert_sprites(spr, output_dir, format, scaling=4):
             image.save(fp, format)
             fp.close()
 
+            paths.append(path)
+
         except IOError:
 
             print("Failed to open file for sprite: %s" % path)
@@ -78,4 +103,4 @@ def convert_sprites(spr, output_dir, format, scaling=4):
             print("Could not convert sprite to format: %s" % format)
             break
 
-    return
+    return paths
@@ -29,7 +29,10 @@
 
 version = '0.22'
 
-import string
+import functools
+import re
+import struct
+import sys
 
 
 class spritefile_error(Exception):
@@ -45,6 +48,134 @@ scale16 = 255.0 / 31.0  # scaling factor for 16 bits per pixel colour
 
 # components
 
+# Lookup table which inverts colour components, converting between RGB and
+# CMY
+inverted = bytes(range(255, -1, -1))
+
+# The sprite area header (number of sprites, offset to the first sprite and
+# offset to the free space) and the header at the start of each sprite. All
+# fields are little endian words apart from the 12 byte sprite name.
+area_header = struct.Struct('<III')
+sprite_header = struct.Struct('<I12sIIIIIII')
+
+# A single little endian word, as used for palette entries and offsets
+# written on their own.
+word_format = struct.Struct('<I')
+
+# The characters which may appear in a sprite name
+name_chars = re.compile(b'[\x21-\xff]*')
+
+# Conversions between the 5 bit colour components of 16 bpp sprites and 8 bit
+# components, rounding as the scale16 factor does
+five_to_eight = bytes([int((value & 0x1f) * scale16) for value in range(256)])
+eight_to_five = bytes([int(value / scale16 + 0.5) for value in range(256)])
+
+# Lookup tables which pick out the blue component of 16 bpp pixels from their
+# high bytes, and the two parts of the green component from each byte. The
+# red component is picked out of the low bytes by five_to_eight.
+blue_high = bytes([five_to_eight[value >> 2] for value in range(256)])
+green_low = bytes([value >> 5 for value in range(256)])
+green_high = bytes([(value & 3) << 3 for value in range(256)])
+
+# Lookup tables which pick out the pixels packed into each byte at 1, 2 and
+# 4 bits per pixel. The tables for (bpp, shift) give each of the pixels in a
+# byte in turn, the first pixel starting at the given bit.
+bit_fields = {}
+
+for bpp in (1, 2, 4):
+    for shift in range(0, bpp):
+        bit_fields[(bpp, shift)] = [
+            bytes([(value >> bit) & ((1 << bpp) - 1) for value in range(256)])
+            for bit in range(shift, 8, bpp)
+        ]
+
+# The standard VIDC 256 colour palette, used by 8 bpp sprites without a
+# palette of their own, as a string of red, green and blue bytes
+vidc256 = bytearray()
+
+for value in range(0, 256):
+    red = ((value & 0x10) >> 1) | (value & 7)
+    green = ((value & 0x40) >> 3) | ((value & 0x20) >> 3) | (value & 3)
+    blue = ((value & 0x80) >> 4) | ((value & 8) >> 1) | (value & 3)
+    vidc256.extend((int(red * scale8), int(green * scale8),
+                    int(blue * scale8)))
+
+vidc256 = bytes(vidc256)
+
+# Lookup tables which convert mask values to alpha levels. An 8 bpp mask
+# stores the alpha level directly, whereas in a 2 bpp mask only a value of
+# 3 is opaque.
+mask_levels = {
+    1: bytes([0, 0xff]) + bytes(254),
+    2: bytes([0, 1, 2, 0xff]) + bytes(252),
+    4: bytes([value | (value << 4) for value in range(16)]) + bytes(240)
+}
+
+# Lookup tables which shift pixel values into place within a byte at 1, 2
+# and 4 bits per pixel, for each pixel in the byte in turn
+pack_fields = {}
+
+for bpp in (1, 2, 4):
+    pack_fields[bpp] = [
+        bytes([(value << bit) & (((1 << bpp) - 1) << bit)
+               for value in range(256)])
+        for bit in range(0, 8, bpp)
+    ]
+
+# Lookup table which picks the nearer of white (0) and black (1) in the
+# standard 1 bpp palette from a component
+dark_levels = bytes([value < 128 for value in range(256)])
+
+# Lookup tables which convert alpha levels to the values stored in 8, 4, 2
+# and 1 bpp masks, where only fully opaque pixels are set
+opaque_levels = {
+    8: bytes(255) + bytes([0xff]),
+    4: bytes(255) + bytes([0xf]),
+    2: bytes(255) + bytes([0x3]),
+    1: bytes(255) + bytes([0x1])
+}
+
+# The tables for picking out pixels from each byte combined with the tables
+# above, so that each byte of a mask is expanded straight to alpha levels
+mask_fields = {}
+
+for (bpp, shift), tables in bit_fields.items():
+    mask_fields[(bpp, shift)] = [table.translate(mask_levels[bpp])
+                                 for table in tables]
+
+
+@functools.lru_cache(maxsize=64)
+def expand_palette(palette):
+    # Expand a 16 or 64 entry palette of an 8 bpp sprite to 256 colours. The
+    # results are cached, since sprites often share the same palette.
+
+    # Each four pairs of entries describes the variation in a particular
+    # colour: 0-3, 4-7, 8-11, 12-15
+    # These colours describe the rest of the 256 colours.
+    size = len(palette)
+    expanded = list(palette)
+
+    for j in range(size, 256, size):
+
+        for i in range(0, size):
+            entry1, entry2 = palette[i]
+
+            # Generate new colours using the palette supplied for the first
+            # colours
+            red = (((j + i) & 0x10) >> 1) | (entry1[0] >> 4)
+            green = (((j + i) & 0x40) >> 3) | \
+                    (((j + i) & 0x20) >> 3) | (entry1[1] >> 4)
+            blue = (((j + i) & 0x80) >> 4) | (entry1[2] >> 4)
+            red = int(red * scale8)
+            green = int(green * scale8)
+            blue = int(blue * scale8)
+
+            # Append new entries
+            expanded.append(((red, green, blue), (red, green, blue)))
+
+    return tuple(expanded)
+
+
 class spritefile:
     """spritefile
     
@@ -109,6 +240,32 @@ class spritefile:
             (0x77, 0x77, 0x77), (0x00, 0x00, 0x00)
         ]
 
+        # The colours of sprites without a palette of their own, as strings
+        # of red, green and blue bytes
+        self.standard_colours = {
+            8: vidc256,
+            4: bytes([component for colour in self.palette16
+                      for component in colour]),
+            2: bytes([component for colour in self.palette4
+                      for component in colour]),
+            1: bytes([0xff, 0xff, 0xff, 0x00, 0x00, 0x00])
+        }
+
+        # Decoders for sprites which do not use a palette; the others are
+        # decoded by indexed2rgb
+        self.decoders = {32: self.direct2rgb, 16: self.highcolour2rgb}
+
+        # Old style mode numbers indexed by (log2bpp, x dpi, y dpi) for
+        # writing sprites, keeping the lowest mode number for each; modes
+        # with a zero scale factor cannot be matched by resolution
+        self.mode_numbers = {}
+
+        for mode_number, (lb, xs, ys) in self.mode_info.items():
+
+            if xs != 0 and ys != 0:
+                self.mode_numbers.setdefault(
+                    (lb, int(90 / xs), int(90 / ys)), mode_number)
+
         if file != None:
             self.read(file)
         else:
@@ -122,138 +279,161 @@ class spritefile:
 
         # Little endian writing
 
-        s = bytearray()
-
-        while size > 0:
-            i = n % 256
-            s.append(i)
-            #           n = n / 256
-            n = n >> 8
-            size = size - 1
+        n = n & ((1 << (size * 8)) - 1)
 
-        return s
+        return bytearray(n.to_bytes(size, 'little'))
 
     def str2num(self, size, s):
 
-        i = 0
-        n = 0
-        while i < size:
-            n = n | (s[i] << (i * 8))
-            i = i + 1
+        # Little endian reading
 
-        return n
+        if len(s) < size:
+            raise spritefile_error('Unexpected end of file.')
 
-    def sprite2rgb(self, file, width, height, h_words, first_bit_used, bpp,
-                   palette):
+        return int.from_bytes(s[:size], 'little')
 
-        # Convert sprite to RGB values
+    def read_rows(self, file, height, h_words, start, length):
 
-        if palette != []:
-            has_palette = 1
+        # Read the whole image in one go, and return the given span of
+        # bytes from each row joined together. Each row occupies h_words
+        # words.
+        row_size = h_words * 4
+        image = file.read(row_size * (height - 1) + start + length)
+
+        if start == 0 and length == row_size:
+            rows = image
         else:
-            has_palette = 0
+            rows = b''.join([image[ptr + start:ptr + start + length]
+                             for ptr in range(0, row_size * height, row_size)])
 
-        rgb = bytearray()
-        ptr = file.tell() * 8  # bit offset
+        if len(rows) < length * height:
+            raise spritefile_error('Sprite image data is truncated.')
 
-        for j in range(0, height):
+        return rows
 
-            row = bytearray()
-            row_ptr = ptr + first_bit_used  # bit offset into the image
+    def read_values(self, file, width, height, h_words, first_bit_used, bpp,
+                    fields=bit_fields):
 
-            for i in range(0, width):
+        # Read the pixel values of a sprite with 8 or fewer bits per pixel,
+        # returning one byte per pixel. Below 8 bits per pixel, the values
+        # are picked out of each byte using the given lookup tables.
 
-                file.seek(row_ptr >> 3, 0)
+        if bpp == 8:
+            return self.read_rows(file, height, h_words, first_bit_used >> 3,
+                                  width)
 
-                # Conversion depends on bpp value
-                if bpp == 32:
+        # Each byte holds several pixels; the lookup tables pick out each
+        # one in turn, starting from the bit offset of the first pixel.
+        per_byte = 8 // bpp
+        skip = (first_bit_used & 7) // bpp
+        tables = fields[(bpp, first_bit_used % bpp)]
 
-                    red = file.read(1)[0]
-                    green = file.read(1)[0]
-                    blue = file.read(1)[0]
-                    row_ptr = row_ptr + 32
+        length = (skip + width + per_byte - 1) // per_byte
+        data = self.read_rows(file, height, h_words, first_bit_used >> 3,
+                              length)
 
-                elif bpp == 16:
+        values = bytearray(len(data) * per_byte)
+        for i in range(0, per_byte):
+            values[i::per_byte] = data.translate(tables[i])
 
-                    value = self.str2num(2, file.read(2))
-                    red = int((value & 0x1f) * scale16)
-                    green = int(((value >> 5) & 0x1f) * scale16)
-                    blue = int(((value >> 10) & 0x1f) * scale16)
-                    row_ptr = row_ptr + 16
+        # Drop the unused pixels at the start and end of each row
+        row_values = length * per_byte
 
-                elif bpp == 8:
+        if skip == 0 and row_values == width:
+            return values
 
-                    if has_palette == 0:
+        return b''.join([values[ptr + skip:ptr + skip + width]
+                         for ptr in range(0, len(values), row_values)])
 
-                        # Standard VIDC 256 colours
-                        value = file.read(1)[0]
-                        red = ((value & 0x10) >> 1) | (value & 7)
-                        green = ((value & 0x40) >> 3) | \
-                                ((value & 0x20) >> 3) | (value & 3)
-                        blue = ((value & 0x80) >> 4) | \
-                               ((value & 8) >> 1) | (value & 3)
-                        red = int(red * scale8)
-                        green = int(green * scale8)
-                        blue = int(blue * scale8)
-                    else:
-                        # 256 entry palette
-                        value = file.read(1)[0]
-                        red, green, blue = palette[value][0]
+    def values2rgb(self, values, colours, step=3):
 
-                    row_ptr = row_ptr + 8
+        # Look up each pixel value in a string of colours, each made up of
+        # red, green and blue bytes.
 
-                elif bpp == 4:
+        if len(values) > 0 and max(values) >= len(colours) // 3:
+            raise spritefile_error('Pixel value outside the palette.')
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0xf
+        rgb = bytearray(len(values) * step)
 
-                    if has_palette == 0:
+        for i in range(0, 3):
+            table = colours[i::3]
+            rgb[i::step] = values.translate(table.ljust(256, b'\x00'))
+
+        return rgb
 
-                        # Standard 16 desktop colours
-                        # Look up the value in the standard palette
-                        red, green, blue = self.palette16[value]
-                    else:
-                        # 16 entry palette
-                        red, green, blue = palette[value][0]
+    def sprite2rgb(self, file, width, height, h_words, first_bit_used, bpp,
+                   palette, step=3):
 
-                    row_ptr = row_ptr + 4
+        # Convert sprite to RGB values. With a step of 4, each pixel is
+        # followed by a zero byte, leaving room for an alpha channel.
 
-                elif bpp == 2:
+        if width <= 0 or height <= 0:
+            return bytearray()
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0x3
+        # Conversion depends on bpp value
+        decode = self.decoders.get(bpp, self.indexed2rgb)
 
-                    if has_palette == 0:
+        return decode(file, width, height, h_words, first_bit_used, bpp,
+                      palette, step)
 
-                        # Greyscales
-                        red, green, blue = self.palette4[value]
-                    else:
-                        # 4 entry palette
-                        red, green, blue = palette[value][0]
+    def direct2rgb(self, file, width, height, h_words, first_bit_used, bpp,
+                   palette, step):
 
-                    row_ptr = row_ptr + 2
+        # Take the red, green and blue bytes of each word of a 32 bpp sprite
+        data = self.read_rows(file, height, h_words, first_bit_used >> 3,
+                              width * 4)
 
-                elif bpp == 1:
+        rgb = bytearray(width * height * step)
+        rgb[0::step] = data[0::4]
+        rgb[1::step] = data[1::4]
+        rgb[2::step] = data[2::4]
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
+        return rgb
 
-                    if has_palette == 0:
+    def highcolour2rgb(self, file, width, height, h_words, first_bit_used,
+                       bpp, palette, step):
 
-                        # Black and white
-                        red = green = blue = (255 * (1 - value))
-                    else:
-                        # 2 entry palette
-                        red, green, blue = palette[value][0]
+        # Expand the 5 bit components of each half word of a 16 bpp sprite
+        data = self.read_rows(file, height, h_words, first_bit_used >> 3,
+                              width * 2)
 
-                    row_ptr = row_ptr + 1
+        low = data[0::2]
+        high = data[1::2]
 
-                row.append(red)
-                row.append(green)
-                row.append(blue)
+        # Green is split between the two bytes of each half word, so its
+        # two parts are combined as little endian integers
+        green = int.from_bytes(low.translate(green_low), 'little') | \
+            int.from_bytes(high.translate(green_high), 'little')
+        green = green.to_bytes(len(low), 'little')
 
-            rgb = rgb + row
-            ptr = ptr + (h_words * 32)
+        rgb = bytearray(width * height * step)
+        rgb[0::step] = low.translate(five_to_eight)
+        rgb[1::step] = green.translate(five_to_eight)
+        rgb[2::step] = high.translate(blue_high)
 
         return rgb
 
+    def indexed2rgb(self, file, width, height, h_words, first_bit_used, bpp,
+                    palette, step):
+
+        # Look up the pixels of a sprite with 8 or fewer bpp in its palette
+        values = self.read_values(file, width, height, h_words,
+                                  first_bit_used, bpp)
+
+        if palette != []:
+
+            # 256, 16, 4 or 2 entry palette
+            colours = bytes([component for entry1, entry2 in palette
+                             for component in entry1])
+
+        else:
+
+            # Standard VIDC 256 colours, 16 desktop colours, greyscales, or
+            # black and white
+            colours = self.standard_colours[bpp]
+
+        return self.values2rgb(values, colours, step)
+
     def sprite2cmyk(self, file, width, height, h_words):
 
         # Read a CMYK sprite.
@@ -285,149 +465,53 @@ class spritefile:
         return file.read(width * height * 4)
         # return string.join(cmyk, '')
 
-    def mask2byte(self, file, width, height, bpp):
-
-        mask = bytearray()
-
-        ptr = file.tell() * 8  # bit offset
-        image_ptr = 0
-
-        if bpp == 32 or bpp == 16:
-            bpp = 1
+    def mask_words(self, width, bpp):
 
         # Colour depths below 16 bpp have the same number of bpp in the mask
-        bits = bpp * width
-
-        row_size = bits >> 5  # number of words
-        if bits % 32 != 0:
-            row_size = row_size + 1
-
-        for j in range(0, height):
-
-            row = bytearray()
-            row_ptr = ptr  # bit offset into the image
-
-            for i in range(0, width):
-
-                file.seek(row_ptr >> 3, 0)
-
-                # Conversion depends on bpp value
-                if bpp == 32:
-
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
-
-                elif bpp == 16:
-
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
-
-                elif bpp == 8:
-
-                    value = file.read(1)[0]
-                    row_ptr = row_ptr + 8
-
-                elif bpp == 4:
-
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0xf
-                    value = value | (value << 4)
-                    row_ptr = row_ptr + 4
-
-                elif bpp == 2:
-
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0x3
-                    if value == 3:
-                        value = 0xff
-                    row_ptr = row_ptr + 2
-
-                elif bpp == 1:
-
-                    # Black and white
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
-
-                row.append(value)
-
-            mask = mask + row
-            ptr = ptr + (row_size * 32)
-
-        return mask
-
-    def mask2rgba(self, file, width, height, first_bit_used, bpp, image):
-
-        rgba = bytearray()
-
-        ptr = file.tell() * 8  # bit offset
-        image_ptr = 0
-
         if bpp == 32 or bpp == 16:
             bpp = 1
 
-        # Colour depths below 16 bpp have the same number of bpp in the mask
         bits = bpp * width
 
         row_size = bits >> 5  # number of words
         if bits % 32 != 0:
             row_size = row_size + 1
 
-        for j in range(0, height):
-
-            row = bytearray()
-            row_ptr = ptr + first_bit_used  # bit offset into the image
+        return bpp, row_size
 
-            for i in range(0, width):
-
-                file.seek(row_ptr >> 3, 0)
-
-                # Conversion depends on bpp value
-                if bpp == 32:
-
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
-
-                elif bpp == 16:
+    def mask2byte(self, file, width, height, bpp):
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
+        return bytearray(self.mask2alpha(file, width, height, 0, bpp))
 
-                elif bpp == 8:
+    def mask2alpha(self, file, width, height, first_bit_used, bpp):
 
-                    value = file.read(1)[0]
-                    row_ptr = row_ptr + 8
+        # Read a mask, returning one alpha byte per pixel
 
-                elif bpp == 4:
+        if width <= 0 or height <= 0:
+            return b''
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0xf
-                    value = value | (value << 4)
-                    row_ptr = row_ptr + 4
+        bpp, row_size = self.mask_words(width, bpp)
 
-                elif bpp == 2:
+        return self.read_values(file, width, height, row_size,
+                                first_bit_used, bpp, mask_fields)
 
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 0x3
-                    if value == 3:
-                        value = 0xff
-                    row_ptr = row_ptr + 2
+    def mask2rgba(self, file, width, height, first_bit_used, bpp, image):
 
-                elif bpp == 1:
+        if width <= 0 or height <= 0:
+            return bytearray()
 
-                    # Black and white
-                    value = (file.read(1)[0] >> (row_ptr % 8)) & 1
-                    value = value * 0xff
-                    row_ptr = row_ptr + 1
+        values = self.mask2alpha(file, width, height, first_bit_used, bpp)
 
-                row.append(image[image_ptr])
-                row.append(image[image_ptr+1])
-                row.append(image[image_ptr+2])
-                row.append(value)
-                image_ptr = image_ptr + 3
+        size = len(values) * 3
+        if len(image) < size:
+            raise spritefile_error('Sprite image is smaller than its mask.')
 
-            rgba = rgba + row
-            ptr = ptr + (row_size * 32)
+        # Interleave the red, green and blue components with the mask
+        rgba = bytearray(len(values) * 4)
+        rgba[0::4] = image[0:size:3]
+        rgba[1::4] = image[1:size:3]
+        rgba[2::4] = image[2:size:3]
+        rgba[3::4] = values
 
         return rgba
 
@@ -436,42 +520,37 @@ class spritefile:
         # Go to start of this sprite
         file.seek(offset, 0)
 
-        next = self.str2num(4, file.read(4))
+        header = file.read(sprite_header.size)
+
+        if len(header) < sprite_header.size:
+            raise spritefile_error('Unexpected end of file.')
+
+        next, n, h_words, v_lines, first_bit_used, last_bit_used, \
+            image_ptr, mask_ptr, mode = sprite_header.unpack(header)
 
         # We will return a data dictionary
         data = {}
 
-        n = file.read(12)
-        name = ''
-        for i in n:
-            if i > 32:
-                name = name + chr(i)
-            else:
-                break
+        # The name runs up to the first control character or space
+        name = name_chars.match(n).group().decode('latin-1')
 
-        # Read width of sprite in words and height in scan lines.
+        # Width of sprite in words and height in scan lines.
         # These is stored in the Spritefile as width-1 and height-1.
-        h_words = self.str2num(4, file.read(4)) + 1
-        v_lines = self.str2num(4, file.read(4)) + 1
+        h_words = h_words + 1
+        v_lines = v_lines + 1
 
         data['h_words'] = h_words
         data['v_lines'] = v_lines
 
         # The bits used in each word.
-        first_bit_used = self.str2num(4, file.read(4))
-        last_bit_used = self.str2num(4, file.read(4))
-
         data['first bit'] = first_bit_used
         data['last bit'] = last_bit_used
 
         # The pointers to the image and mask are found from the offsets
         # relative to the start of the sprite; i.e. from the next sprite
         # offset.
-        image_ptr = offset + self.str2num(4, file.read(4))
-        mask_ptr = offset + self.str2num(4, file.read(4))
-
-        # The mode number of the sprite.
-        mode = self.str2num(4, file.read(4))
+        image_ptr = offset + image_ptr
+        mask_ptr = offset + mask_ptr
 
         bpp = (mode >> 27)
 
@@ -539,68 +618,30 @@ class spritefile:
 
         palette = []
 
-        # Read palette, if present, putting the values into a list
-        while file.tell() < image_ptr:
-            file.seek(1, 1)  # skip a byte
-            # First entry (red, green, blue)
-            entry1 = (file.read(1)[0], file.read(1)[0], file.read(1)[0])
-            file.seek(1, 1)  # skip a byte
-            # Second entry (red, green, blue)
-            entry2 = (file.read(1)[0], file.read(1)[0], file.read(1)[0])
-            palette.append((entry1, entry2))
-
-        if palette != []:
-
-            if bpp == 8 and len(palette) < 256:
-
-                if len(palette) == 16:
-
-                    # Each four pairs of entries describes the variation
-                    # in a particular colour: 0-3, 4-7, 8-11, 12-15
-                    # These sixteen colours describe the rest of the 256
-                    # colours.
-
-                    for j in range(16, 256, 16):
-
-                        for i in range(0, 16):
-                            entry1, entry2 = palette[i]
-
-                            # Generate new colours using the palette
-                            # supplied for the first 16 colours
-                            red = (((j + i) & 0x10) >> 1) | (entry1[0] >> 4)
-                            green = (((j + i) & 0x40) >> 3) | \
-                                    (((j + i) & 0x20) >> 3) | (entry1[1] >> 4)
-                            blue = (((j + i) & 0x80) >> 4) | (entry1[2] >> 4)
-                            red = int(red * scale8)
-                            green = int(green * scale8)
-                            blue = int(blue * scale8)
+        # Read palette, if present, putting the values into a list. Each
+        # entry is a pair of words, each holding a skipped byte followed by
+        # the red, green and blue components.
+        entries = (image_ptr - file.tell() + 7) >> 3
 
-                            # Append new entries
-                            palette.append(
-                                ((red, green, blue), (red, green, blue)))
+        if entries > 0:
+            entry_data = file.read(entries * 8)
 
-                elif len(palette) == 64:
+            if len(entry_data) < entries * 8:
+                raise spritefile_error('Unexpected end of file.')
 
-                    for j in range(64, 256, 64):
+            palette = list(zip(
+                zip(entry_data[1::8], entry_data[2::8], entry_data[3::8]),
+                zip(entry_data[5::8], entry_data[6::8], entry_data[7::8])
+            ))
 
-                        for i in range(0, 64):
-                            entry1, entry2 = palette[i]
+        if palette != []:
 
-                            red = (((j + i) & 0x10) >> 1) | (entry1[0] >> 4)
-                            green = (((j + i) & 0x40) >> 3) | \
-                                    (((j + i) & 0x20) >> 3) | (entry1[1] >> 4)
-                            blue = (((j + i) & 0x80) >> 4) | (entry1[2] >> 4)
-                            red = int(red * scale8)
-                            green = int(green * scale8)
-                            blue = int(blue * scale8)
+            if bpp == 8 and (len(palette) == 16 or len(palette) == 64):
 
-                            # Append new entries
-                            palette.append(
-                                ((red, green, blue), (red, green, blue)))
+                # The first 16 or 64 colours describe the rest of the 256
+                palette = list(expand_palette(tuple(palette)))
 
-                data['palette'] = palette
-            else:
-                data['palette'] = palette
+            data['palette'] = palette
 
         # The width of the sprite is the number of words used divided by the
         # bits per pixel of the sprite. Additionally, the parts of the sprite
@@ -615,6 +656,24 @@ class spritefile:
         # Obtain image data
         file.seek(image_ptr, 0)
 
+        if data['mode'] == 'RGB' and mask_ptr != image_ptr:
+
+            # Decode the image straight into RGBA form, leaving a gap for
+            # the alpha channel, which is then filled in from the mask
+            data['image'] = self.sprite2rgb(file, width, height, h_words,
+                                            first_bit_used, bpp, palette, 4)
+
+            file.seek(mask_ptr, 0)
+
+            data['image'][3::4] = self.mask2alpha(
+                file, width, height, first_bit_used, bpp
+            )
+
+            # The image is stored in RGBA form.
+            data['mode'] = 'RGBA'
+
+            return name, data, next
+
         if data['mode'] == 'RGB':
             data['image'] = self.sprite2rgb(file, width, height, h_words,
                                             first_bit_used, bpp, palette)
@@ -643,9 +702,14 @@ class spritefile:
         file.seek(0, 0)
 
         # Examine the sprites
-        number = self.str2num(4, file.read(4))
-        offset = self.str2num(4, file.read(4)) - 4
-        free = self.str2num(4, file.read(4)) - 4
+        header = file.read(area_header.size)
+
+        if len(header) < area_header.size:
+            raise spritefile_error('Unexpected end of file.')
+
+        number, offset, free = area_header.unpack(header)
+        offset = offset - 4
+        free = free - 4
 
         self.sprites = {}
 
@@ -655,6 +719,56 @@ class spritefile:
             self.sprites[name] = data
             offset = offset + next
 
+    def colour_words(self, image, count, step):
+
+        # Return the colours of the pixels in an RGB or RGBA image as words
+        # of the form (red << 16) | (green << 8) | blue
+        words = bytearray(count * 4)
+
+        if sys.byteorder == 'little':
+            words[2::4] = image[0:count * step:step]
+            words[1::4] = image[1:count * step:step]
+            words[0::4] = image[2:count * step:step]
+        else:
+            words[1::4] = image[0:count * step:step]
+            words[2::4] = image[1:count * step:step]
+            words[3::4] = image[2:count * step:step]
+
+        return memoryview(words).cast('I')
+
+    def pack_values(self, values, width, height, bpp):
+
+        # Pack values of one byte per pixel into rows of whole words at 8, 4,
+        # 2 or 1 bits per pixel
+        if width <= 0 or height <= 0:
+            return bytearray()
+
+        per_byte = 8 // bpp
+        row_values = ((width * bpp + 31) >> 5) * (32 // bpp)
+
+        # Pad each row to a whole number of words
+        if row_values != width:
+            padded = bytearray(row_values * height)
+
+            for j in range(0, height):
+                padded[j * row_values:j * row_values + width] = \
+                    values[j * width:(j + 1) * width]
+
+            values = padded
+
+        if per_byte == 1:
+            return bytearray(values)
+
+        # Shift the values for each position within a byte into place, and
+        # combine them into a single little endian integer
+        packed = 0
+
+        for i in range(0, per_byte):
+            packed = packed | int.from_bytes(
+                values[i::per_byte].translate(pack_fields[bpp][i]), 'little')
+
+        return bytearray(packed.to_bytes(len(values) // per_byte, 'little'))
+
     def rgb2sprite(self, name):
 
         data = self.sprites[name]
@@ -691,9 +805,8 @@ class spritefile:
         # Storage mode: RGB or RGBA
         mode = data['mode']
 
-        # Sprite and mask strings
-        sprite = bytearray()
-        mask = bytearray()
+        # Sprite words, used for 32 and 16 bpp sprites
+        sprite = []
 
         # If there was either a palette specified or a standard one used
         # then create an inverse.
@@ -702,214 +815,166 @@ class spritefile:
             # Create inverse palette dictionary
             inverse = {}
 
-            for i in range(0, len(palette)):
+            # There may be a list of two tuples in each palette entry.
+            if not isinstance(palette[0][0], int):
 
-                # There may be a list of two tuples in each palette entry.
-                if type(palette[i][0]) != type(0):
-                    inverse[palette[i][0]] = i
-                    inverse[palette[i][1]] = i
-                else:
-                    # There may just be one tuple (for standard palettes).
-                    inverse[palette[i]] = i
+                for i, (entry1, entry2) in enumerate(palette):
+                    inverse[entry1] = i
+                    inverse[entry2] = i
+            else:
+                # There may just be one tuple (for standard palettes).
+                for i, entry in enumerate(palette):
+                    inverse[entry] = i
 
             # Store the inverse palette for convenience.
             self.sprites[name]['inverse'] = inverse
 
-        # Write the image data to the sprite and mask
-        ptr = 0
-
-        for j in range(0, data['height']):
+            # Key the inverse palette by colour words for the lookups below,
+            # to avoid making a tuple for every pixel
+            index_of = {}
 
-            sprite_word = 0
-            mask_word = 0
-            sprite_ptr = 0
-            mask_ptr = 0
+            for (r, g, b), i in inverse.items():
+                index_of[(r << 16) | (g << 8) | b] = i
 
-            for i in range(0, data['width']):
+        # Number of pixels, and the step between them in the image
+        count = max(data['width'], 0) * data['height']
 
-                # Read the red, green and blue components
-                r = image[ptr]
-                g = image[ptr + 1]
-                b = image[ptr + 2]
-
-                if mode == 'RGBA':
-
-                    a = image[ptr + 3]
-                    ptr = ptr + 4
-                else:
-                    # No alpha component
-                    ptr = ptr + 3
-
-                # Write the pixels to the sprite and mask
-                if bpp == 32:
-
-                    # Store the components in the sprite word
-                    sprite_word = r | (g << 8) | (b << 16)  # was b << 24 !
-                    sprite_ptr = 32
-
-                    # Store mask data if relevant
-                    if mode == 'RGBA':
-                        mask_word = mask_word | ((a == 255) << mask_ptr)
-                        mask_ptr = mask_ptr + 1
-
-                elif bpp == 16:
-
-                    # Convert the components to the relevant form
-                    half_word = int(r / scale16) | \
-                                (int(g / scale16) << 5) | \
-                                (int(b / scale16) << 10)
-
-                    sprite_word = sprite_word | (half_word << sprite_ptr)
-                    sprite_ptr = sprite_ptr + 16
-
-                    # Store mask data if relevant
-                    if mode == 'RGBA':
-                        mask_word = mask_word | ((a == 255) << mask_ptr)
-                        mask_ptr = mask_ptr + 1
-
-                elif bpp == 8:
+        if mode == 'RGBA':
+            step = 4
+        else:
+            step = 3
 
-                    # If there is a palette then look up the colour index
-                    # in the inverse palette dictionary
-                    if palette != []:
+        if len(image) < count * step:
+            raise spritefile_error('Image data is too short for the sprite.')
 
-                        index = inverse[(r, g, b)]
-                    else:
-                        # Standard palette
-                        red = int(r / scale8)
-                        green = int(g / scale8)
-                        blue = int(b / scale8)
+        if bpp == 1 and palette == []:
 
-                        index = ((red & 0x8) << 1) | (red & 0x4) | \
-                                ((green & 0x8) << 3) | ((green & 0x4) << 3) | \
-                                ((blue & 0x8) << 4) | ((blue & 0x4) << 1) | \
-                                int((red + green + blue) / 15.0)
+            # Use red component; the standard palette has white as colour
+            # 0 and black as colour 1
+            values = image[0:count * step:step].translate(dark_levels)
 
-                    # Store the contents in the sprite word
-                    sprite_word = sprite_word | (index << sprite_ptr)
-                    sprite_ptr = sprite_ptr + 8
+            sprite = self.pack_values(values, data['width'], data['height'],
+                                      bpp)
 
-                    # Store mask data
-                    if mode == 'RGBA':
+        elif bpp <= 8:
 
-                        if a != 0xff:
-                            a = 0
+            words = self.colour_words(image, count, step)
 
-                        mask_word = mask_word | (a << mask_ptr)
-                        mask_ptr = mask_ptr + 8
+            if palette == []:
 
-                elif bpp == 4:
+                # Standard palette - find the nearest VIDC colour to each of
+                # the colours used in the image
+                index_of = {}
 
-                    # Look up bit state in inverse palette
-                    index = inverse[(r, g, b)]
+                for word in set(words):
+                    red = int((word >> 16) / scale8)
+                    green = int(((word >> 8) & 0xff) / scale8)
+                    blue = int((word & 0xff) / scale8)
 
-                    # Store the contents in the sprite word
-                    sprite_word = sprite_word | (index << sprite_ptr)
-                    sprite_ptr = sprite_ptr + 4
+                    index_of[word] = \
+                        ((red & 0x8) << 1) | (red & 0x4) | \
+                        ((green & 0x8) << 3) | ((green & 0x4) << 3) | \
+                        ((blue & 0x8) << 4) | ((blue & 0x4) << 1) | \
+                        (((red & 3) + (green & 3) + (blue & 3)) // 3)
 
-                    # Store mask data
-                    if mode == 'RGBA':
+            # Look up the colour of each pixel in the inverse palette
+            values = bytes(map(index_of.__getitem__, words))
 
-                        if a == 0xff:
-                            a = 0xf
-                        else:
-                            a = 0
+            sprite = self.pack_values(values, data['width'], data['height'],
+                                      bpp)
 
-                        mask_word = mask_word | (a << mask_ptr)
-                        mask_ptr = mask_ptr + 4
+        else:
 
-                elif bpp == 2:
+            # Write the image data to the sprite
+            ptr = 0
 
-                    # Look up bit state in inverse palette
-                    index = inverse[(r, g, b)]
+            for j in range(0, data['height']):
 
-                    # Store the contents in the sprite word
-                    sprite_word = sprite_word | (index << sprite_ptr)
-                    sprite_ptr = sprite_ptr + 2
+                sprite_word = 0
+                sprite_ptr = 0
 
-                    # Store mask data
-                    if mode == 'RGBA':
+                for i in range(0, data['width']):
 
-                        if a == 0xff:
-                            a = 0x3
-                        else:
-                            a = 0
+                    # Read the red, green and blue components
+                    r = image[ptr]
+                    g = image[ptr + 1]
+                    b = image[ptr + 2]
+                    ptr = ptr + step
 
-                        mask_word = mask_word | (a << mask_ptr)
-                        mask_ptr = mask_ptr + 2
+                    # Write the pixels to the sprite
+                    if bpp == 32:
 
-                elif bpp == 1:
+                        # Store the components in the sprite word
+                        sprite_word = r | (g << 8) | (b << 16)  # was b << 24 !
+                        sprite_ptr = 32
 
-                    if palette != []:
+                    elif bpp == 16:
 
-                        # Look up bit state in inverse palette
-                        bit = inverse[(r, g, b)]
-                    else:
-                        # Use red component
-                        bit = (r == 255)
+                        # Convert the components to the relevant form
+                        half_word = eight_to_five[r] | \
+                                    (eight_to_five[g] << 5) | \
+                                    (eight_to_five[b] << 10)
 
-                    # Append bit to byte
-                    sprite_word = sprite_word | (bit << sprite_ptr)
-                    sprite_ptr = sprite_ptr + 1
+                        sprite_word = sprite_word | (half_word << sprite_ptr)
+                        sprite_ptr = sprite_ptr + 16
 
-                    # Determine mask bit if present
-                    if mode == 'RGBA':
-                        mask_word = mask_word | ((a == 255) << mask_ptr)
-                        mask_ptr = mask_ptr + 1
+                    # Write the sprite word to the sprite string if the word is
+                    # full
+                    if sprite_ptr == 32:
+                        # End of word, so reset offset,
+                        sprite_ptr = 0
+                        # store the word in the sprite string
+                        sprite.append(sprite_word)
+                        # and reset the byte
+                        sprite_word = 0
 
-                # Write the sprite word to the sprite string if the word is
-                # full
-                if sprite_ptr == 32:
-                    # End of word, so reset offset,
-                    sprite_ptr = 0
+                # Write any remaining sprite data to the sprite string
+                if sprite_ptr > 0:
                     # store the word in the sprite string
-                    sprite = sprite + self.number(4, sprite_word)
-                    # and reset the byte
-                    sprite_word = 0
+                    sprite.append(sprite_word)
 
-                # Do the same for the mask
-                if mask_ptr == 32:
-                    mask_ptr = 0
-                    mask = mask + self.number(4, mask_word)
-                    mask_word = 0
+            sprite = bytearray(struct.pack('<%dI' % len(sprite), *sprite))
 
-            # Write any remaining sprite data to the sprite string
-            if sprite_ptr > 0:
-                # store the word in the sprite string
-                sprite = sprite + self.number(4, sprite_word)
+        # Store mask data; 16 and 32 bpp sprites have 1 bpp masks
+        if mode == 'RGBA':
 
-            # Do the same for the mask
-            if mask_ptr > 0:
-                mask = mask + self.number(4, mask_word)
+            if bpp <= 8:
+                mask_bpp = bpp
+            else:
+                mask_bpp = 1
 
-        # Determine the actual number of words used per line of
-        # the sprite.
+            values = image[3:count * 4:4].translate(opaque_levels[mask_bpp])
+            mask = self.pack_values(values, data['width'], data['height'],
+                                    mask_bpp)
+        else:
+            mask = bytearray()
 
-        # The number of bits in the line.
-        width_bits = data['width'] * bpp
-        # The excess number of bits (not filling a word completely).
-        excess_bits = width_bits % 32
-        # The number of excess words is therefore either one or zero.
-        excess_words = excess_bits != 0
-        # The number of words used.
-        width = int(width_bits / 32) + excess_words
+        # Determine the actual number of words used per line of
+        # the sprite, rounding the number of bits in the line up to a
+        # whole number of words.
+        width = (data['width'] * bpp + 31) >> 5
 
         self.sprites[name]['h_words'] = width
         self.sprites[name]['v_lines'] = data['height']
 
+        # Each line starts at the beginning of a word, so the last bit
+        # used is the last bit of the final pixel in the line
         self.sprites[name]['first bit'] = 0
-        self.sprites[name]['last bit'] = bpp - 1
+        self.sprites[name]['last bit'] = (data['width'] * bpp - 1) & 31
 
         if has_palette == 1:
 
             # Convert the palette into a string
-            palette_string = bytearray()
+            palette_string = []
+            pack_word = word_format.pack
 
             for (r1, g1, b1), (r2, g2, b2) in palette:
                 word = (r1 << 8) | (g1 << 16) | (b1 << 24)
-                palette_string = palette_string + self.number(4, word)
+                palette_string.append(pack_word(word))
                 word = (r2 << 8) | (g2 << 16) | (b2 << 24)
-                palette_string = palette_string + self.number(4, word)
+                palette_string.append(pack_word(word))
+
+            palette_string = bytearray().join(palette_string)
 
             # Return sprite, mask and palette strings
             return sprite, mask, palette_string
@@ -923,38 +988,21 @@ class spritefile:
         # Image data
         image = data['image']
 
-        # Sprite and mask strings
-        sprite = []
-
-        # Write the image data to the sprite and mask
-        ptr = 0
-
-        for j in range(0, data['height']):
+        # Each pixel occupies a whole word with the cyan, magenta, yellow
+        # and key components in increasing order of significance, which is
+        # the order they are stored in the image, so the sprite string is
+        # just a copy of the image data.
+        size = data['width'] * 4 * data['height']
 
-            for i in range(0, data['width']):
-                # Read the red, green and blue components
-                cyan = image[ptr]
-                magenta = image[ptr + 1]
-                yellow = image[ptr + 2]
-                key = image[ptr + 3]
+        if len(image) < size:
+            raise spritefile_error('Image data is too short for the sprite.')
 
-                # Store the components in the sprite word
-                sprite_word = cyan | (magenta << 8) | (yellow << 16) | (key << 24)
-
-                # store the word in the sprite string
-                sprite.append(self.number(4, sprite_word))
+        # Use the image data in place rather than copying it
+        sprite = memoryview(image)[0:size].toreadonly()
 
         # Determine the actual number of words used per line of
-        # the sprite.
-
-        # The number of bits in the line.
-        width_bits = data['width'] * 32
-        # The excess number of bits (not filling a word completely).
-        excess_bits = width_bits % 32
-        # The number of excess words is therefore either one or zero.
-        excess_words = excess_bits != 0
-        # The number of words used.
-        width = int(width_bits / 32) + excess_words
+        # the sprite, which is one per pixel.
+        width = data['width']
 
         self.sprites[name]['h_words'] = width
         self.sprites[name]['v_lines'] = data['height']
@@ -962,7 +1010,19 @@ class spritefile:
         self.sprites[name]['first bit'] = 0
         self.sprites[name]['last bit'] = 31
 
-        return string.join(sprite, '')
+        return sprite
+
+    def planes(self, image, step):
+
+        # Split an image with the given number of bytes per pixel into a
+        # separate string for each component
+
+        if len(image) % step != 0:
+            raise spritefile_error('Image is not made of whole pixels.')
+
+        # Each slice is a single copy of one component, of the same type
+        # as the image
+        return [image[i::step] for i in range(0, step)]
 
     def rgb2cmyk(self, sprite, trans=None):
 
@@ -971,34 +1031,54 @@ class spritefile:
         if sprite['mode'] != 'RGB':
             raise spritefile_error('Image is not an RGB image.')
 
-        cmyk = bytearray()
-
         if trans is None:
 
             # Default translation between RGB and CMYK.
-            for i in range(0, len(image), 3):
-                r, g, b = image[i], image[i + 1], image[i + 2]
-                cyan = 255 - r
-                magenta = 255 - g
-                yellow = 255 - b
-                key = int(((255 - r) + (255 - g) + (255 - b)) / 3.0)
-
-                cmyk.append(cyan)
-                cmyk.append(magenta)
-                cmyk.append(yellow)
-                cmyk.append(key)
+            red, green, blue = self.planes(image, 3)
+            count = len(red)
+
+            cyan = red.translate(inverted)
+            magenta = green.translate(inverted)
+            yellow = blue.translate(inverted)
+
+            # The key is the mean of the other three components, rounded
+            # down. Their sum is worked out for every pixel at once, in
+            # 32 bit lanes of a single integer, and multiplying it by
+            # 0x5556 leaves the sum divided by three in the third byte of
+            # each lane. This is exact, and never carries into the next
+            # lane, because the sum is at most 765 and 765 * 0x5556 is
+            # less than 2**24. The lanes are laid out in the output itself,
+            # whose other bytes are still zero, before it is filled in.
+            cmyk = bytearray(count * 4)
+            total = 0
+
+            for component in (cyan, magenta, yellow):
+                cmyk[0::4] = component
+                total = total + int.from_bytes(cmyk, 'little')
+
+            total = (total * 0x5556).to_bytes(count * 4, 'little')
+
+            cmyk[0::4] = cyan
+            cmyk[1::4] = magenta
+            cmyk[2::4] = yellow
+            cmyk[3::4] = total[2::4]
 
         else:
 
-            # Custom translation between RGB and CMYK.
-            for i in range(0, len(image), 3):
-                r, g, b = image[i], image[i + 1], image[i + 2]
-                cyan, magenta, yellow, key = trans(r, g, b)
+            # Custom translation between RGB and CMYK, applied to the
+            # components of each pixel in turn.
+            planes = self.planes(image, 3)
+
+            cmyk = bytearray(len(planes[0]) * 4)
+            j = 0
 
-                cmyk.append(cyan)
-                cmyk.append(magenta)
-                cmyk.append(yellow)
-                cmyk.append(key)
+            for cyan, magenta, yellow, key in map(trans, *planes):
+
+                cmyk[j] = cyan
+                cmyk[j + 1] = magenta
+                cmyk[j + 2] = yellow
+                cmyk[j + 3] = key
+                j = j + 4
 
         new_sprite = \
             {
@@ -1020,34 +1100,32 @@ class spritefile:
         if sprite['mode'] != 'CMYK':
             raise spritefile_error('Image is not a CMYK image.')
 
-        rgb = bytearray()
-
         if trans is None:
 
-            # Default translation between CMYK and RGB.
-            for i in range(0, len(image), 4):
-                c, m, y = image[i], image[i + 1], image[i + 2]
-                k = image[i + 3]
-                red = 255 - c
-                green = 255 - m
-                blue = 255 - y
+            # Default translation between CMYK and RGB, which ignores the
+            # key component.
+            cyan, magenta, yellow, key = self.planes(image, 4)
 
-                rgb.append(red)
-                rgb.append(green)
-                rgb.append(blue)
+            rgb = bytearray(len(cyan) * 3)
+            rgb[0::3] = cyan.translate(inverted)
+            rgb[1::3] = magenta.translate(inverted)
+            rgb[2::3] = yellow.translate(inverted)
 
         else:
 
-            # Custom translation between CMYK and RGB.
-            for i in range(0, len(image), 4):
-                c, m, y = image[i], image[i + 1], image[i + 2]
-                k = image[i + 3]
+            # Custom translation between CMYK and RGB, applied to the
+            # components of each pixel in turn.
+            planes = self.planes(image, 4)
+
+            rgb = bytearray(len(planes[0]) * 3)
+            j = 0
 
-                red, green, blue = trans(c, m, y, k)
+            for red, green, blue in map(trans, *planes):
 
-                rgb.append(red)
-                rgb.append(green)
-                rgb.append(blue)
+                rgb[j] = red
+                rgb[j + 1] = green
+                rgb[j + 2] = blue
+                j = j + 3
 
         new_sprite = \
             {
@@ -1078,69 +1156,31 @@ class spritefile:
             # Using the bits per pixel of the image, convert the
             # RGB or RGBA image to an appropriate pixel format.
             sprite = self.cmyk2sprite(name)
-            mask = ''
-            palette = ''
-
-        # Determine the sprite header minus the offset to the next sprite.
-        header = name[:12] + ((12 - len(name[:12])) * '\x00') + \
-                 self.number(4, data['h_words'] - 1) + \
-                 self.number(4, data['v_lines'] - 1) + \
-                 self.number(4, data['first bit']) + \
-                 self.number(4, data['last bit'])
-
-        if mask != '':
-
-            # Write offsets to sprite and mask.
-            header = header + \
-                     self.number(4, 4 + 12 + 16 + 8 + 4 + len(palette))
-            header = header + \
-                     self.number(4, 4 + 12 + 16 + 8 + 4 + len(palette) + len(sprite))
-            # Note         ^   ^    ^    ^   ^
-            #              |   |    |    |   bpp word
-            #              |   |    |    sprite and mask offsets
-            #              |   |    h_words, v_lines, first bit, last bit
-            #              |   sprite name
-            #              next sprite offset
-        else:
-            # Write the sprite offset twice.
-            header = header + \
-                     self.number(4, 4 + 12 + 16 + 8 + 4 + len(palette))
-            header = header + \
-                     self.number(4, 4 + 12 + 16 + 8 + 4 + len(palette))
+            mask = bytearray()
+            palette = bytearray()
 
         # Determine the screen mode from the bpp, xdpi and ydpi
-        # The bits per pixel of the sprite is produced using a look-up table.
-        if data['bpp'] == 1:
-            log2bpp = 0
-            mode = 1
-        elif data['bpp'] == 2:
-            log2bpp = 1
-            mode = 2
-        elif data['bpp'] == 4:
-            log2bpp = 2
-            mode = 3
-        elif data['bpp'] == 8:
-            log2bpp = 3
-            mode = 4
-        elif data['bpp'] == 16:
-            log2bpp = 4
-            mode = 5
-        elif data['bpp'] == 32:
-            log2bpp = 5
-            mode = 6
-        else:
+        bpp = data['bpp']
+
+        if bpp not in (1, 2, 4, 8, 16, 32):
             raise spritefile_error('Invalid number of bits per pixel in sprite.')
 
+        # The new style mode type follows directly from the number of bits
+        # per pixel, starting at 1 for 1 bpp.
+        log2bpp = bpp.bit_length() - 1
+        mode = log2bpp + 1
+
+        # CMYK sprites have a mode type of their own
+        if data['mode'] == 'CMYK':
+            mode = 7
+
         mode_word = None
 
         if mode < 4:
 
             # Try to find an old style mode number for sprites with 16 colours or less.
-            for mode_number, (lb, xs, ys) in list(self.mode_info.items()):
-
-                if log2bpp == lb and data['dpi x'] == int(90 / xs) and data['dpi y'] == int(90 / ys):
-                    mode_word = mode_number
-                    break
+            mode_word = self.mode_numbers.get(
+                (log2bpp, data['dpi x'], data['dpi y']))
 
         if mode_word is None:
             # Generate a new format mode description rather than an old style
@@ -1150,28 +1190,37 @@ class spritefile:
                         ((data['dpi y'] & 0x1fff) << 14) | \
                         1
 
-        header = header + self.number(4, mode_word)
+        # The offset to the image data from the start of the sprite:
+        # next sprite offset (4), sprite name (12), h_words, v_lines,
+        # first bit and last bit (16), sprite and mask offsets (8) and
+        # the mode word (4), followed by the palette.
+        pre = 44 + len(palette)
 
-        # Write the next sprite offset for this sprite:
-        # this word + sprite header + palette + sprite + mask
-        file.write(
-            self.number(
-                4, 4 + len(header) + len(palette) + len(sprite) + len(mask)))
+        if mask:
+            # The mask follows the image data.
+            mask_offset = pre + len(sprite)
+        else:
+            # Write the sprite offset twice.
+            mask_offset = pre
 
-        # Write the sprite header
-        file.write(header)
+        # The size of this sprite, which is the offset to the next one:
+        # sprite header + palette + sprite + mask
+        size = pre + len(sprite) + len(mask)
 
-        # Write the palette
-        file.write(palette)
+        # Words are written modulo 2**32, as self.number does.
+        word = 0xffffffff
 
-        # Write the image data
-        file.write(sprite)
+        header = sprite_header.pack(
+            size, name[:12].encode('latin-1'),
+            (data['h_words'] - 1) & word, (data['v_lines'] - 1) & word,
+            data['first bit'] & word, data['last bit'] & word,
+            pre, mask_offset, mode_word & word)
 
-        # Write the mask
-        file.write(mask)
+        # Write the header, palette, image data and mask together
+        file.write(bytearray().join((header, palette, sprite, mask)))
 
         # Return the amount of data written to the file
-        return 4 + len(header) + len(palette) + len(sprite) + len(mask)
+        return size
 
     def write(self, file):
         """write(self, file)
@@ -1179,31 +1228,33 @@ class spritefile:
         Write the sprites to a file specified by a file object.
         """
 
+        write_details = self.write_details
+
         # Count the sprites in the area
-        number = len(list(self.sprites.keys()))
-        file.write(self.number(4, number))
+        number = len(self.sprites)
 
         # Put the sprites in the standard place
         offset = 16
-        file.write(self.number(4, offset))
 
         # The free space offset points to after all the sprites
         # so we need to know how much space they take up.
 
         # Record the position of the free space pointer in the
         # file.
-        free_ptr = file.tell()
-        # Put a zero word in as a placeholder
-        file.write(self.number(4, 0))
+        free_ptr = file.tell() + 8
+
+        # Write the area header with a zero word as a placeholder for
+        # the free space offset
+        file.write(area_header.pack(number, offset, 0))
 
         # The offset will start after the number, first sprite offset
         # and free space offset.
         free = 16
 
         # Write the sprites to the file
-        for name in list(self.sprites.keys()):
-            free = free + self.write_details(file, name)
+        for name in self.sprites:
+            free = free + write_details(file, name)
 
         # Fill in free space pointer
         file.seek(free_ptr, 0)
-        file.write(self.number(4, free))
+        file.write(word_format.pack(free))